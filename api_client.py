@@ -1,12 +1,38 @@
 # -*- coding: utf-8 -*-
+"""Клиент Anthropic Messages API
+
+    client = Anthropic(api_key=...)
+    msg = client.messages.create(model=..., max_tokens=..., messages=[...])
+    msg.text, msg.usage.input_tokens
+
+    with client.messages.stream(...) as stream:
+        for text in stream.text_stream:
+            ...
+        msg = stream.get_final_message()
+
+AsyncAnthropic - то же самое через await. Оба ходят через общий пул
+соединений transport, так что параллельные запросы не открывают
+новые TLS-соединения.
+"""
+
+import asyncio
 import json
-import base64
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import attachments
+import transport
+
 API_URL = "https://api.anthropic.com/v1/messages"
 VERSION = "2023-06-01"
 
+MODEL = "claude-sonnet-4-5-20250929"
+MAX_TOKENS = 4096
+
+# Потоки для AsyncAnthropic - столько же, сколько соединений на хост в пуле
+ASYNC_WORKERS = transport.POOL_PER_HOST
+
 _client_api_key = None
 
 
@@ -31,10 +57,271 @@ def _load_api_key():
     return _client_api_key
 
 
-def _img_to_base64(path):
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+def _headers(api_key):
+    return {
+        "x-api-key": api_key,
+        "anthropic-version": VERSION,
+        "content-type": "application/json",
+    }
+
+
+# === Ответы ===
+
+class APIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"API Error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+@dataclass
+class Usage:
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+
+    def update(self, data):
+        for k, v in (data or {}).items():
+            if hasattr(self, k) and isinstance(v, int):
+                setattr(self, k, v)
+        return self
+
+
+@dataclass
+class ContentBlock:
+    type: str
+    text: str = ""
+    id: str = None
+    name: str = None
+    input: dict = None
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(type=d.get("type", ""), text=d.get("text", ""), id=d.get("id"),
+                   name=d.get("name"), input=d.get("input"))
+
+    def to_dict(self):
+        if self.type == "text":
+            return {"type": "text", "text": self.text}
+        if self.type == "tool_use":
+            return {"type": "tool_use", "id": self.id, "name": self.name, "input": self.input or {}}
+        return {"type": self.type}
+
+
+@dataclass
+class Message:
+    id: str = None
+    model: str = None
+    role: str = "assistant"
+    content: list = field(default_factory=list)
+    stop_reason: str = None
+    usage: Usage = field(default_factory=Usage)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            id=d.get("id"), model=d.get("model"), role=d.get("role", "assistant"),
+            content=[ContentBlock.from_dict(b) for b in d.get("content", [])],
+            stop_reason=d.get("stop_reason"),
+            usage=Usage().update(d.get("usage")),
+        )
+
+    @property
+    def text(self):
+        return "".join(b.text for b in self.content if b.type == "text")
+
+
+def iter_events(response):
+    """SSE-поток Messages API -> события (dict)"""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data: "):
+            continue
+        data = line[6:]
+        if data == b"[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            pass
+
+
+class MessageStream:
+    """Потоковый ответ: события, куски текста и итоговое Message"""
+
+    def __init__(self, response):
+        self.response = response
+        self.message = Message()
+        self._partial_json = {}
+        self._events = self._iter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.response.close()
+
+    def __iter__(self):
+        return self._events
+
+    def _iter(self):
+        msg = self.message
+        for event in iter_events(self.response):
+            kind = event.get("type")
+            if kind == "message_start":
+                m = event.get("message", {})
+                msg.id, msg.model = m.get("id"), m.get("model")
+                msg.usage.update(m.get("usage"))
+            elif kind == "content_block_start":
+                msg.content.append(ContentBlock.from_dict(event.get("content_block", {})))
+            elif kind == "content_block_delta":
+                block = msg.content[event.get("index", len(msg.content) - 1)]
+                delta = event.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    block.text += delta.get("text", "")
+                elif delta.get("type") == "input_json_delta":
+                    i = event.get("index")
+                    self._partial_json[i] = self._partial_json.get(i, "") + delta.get("partial_json", "")
+            elif kind == "content_block_stop":
+                raw = self._partial_json.pop(event.get("index"), None)
+                if raw is not None:
+                    try:
+                        msg.content[event["index"]].input = json.loads(raw) if raw else {}
+                    except ValueError:
+                        msg.content[event["index"]].input = {}
+            elif kind == "message_delta":
+                msg.stop_reason = event.get("delta", {}).get("stop_reason")
+                msg.usage.update(event.get("usage"))
+            elif kind == "error":
+                raise APIError(None, event.get("error", {}).get("message", "stream error"))
+            yield event
+
+    @property
+    def text_stream(self):
+        for event in self._events:
+            if event.get("type") == "content_block_delta":
+                delta = event.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    yield delta.get("text", "")
+
+    def get_final_message(self):
+        for _ in self._events:
+            pass
+        return self.message
+
+
+# === Клиент ===
+
+class Messages:
+    def __init__(self, client):
+        self.client = client
 
+    def create(self, **params):
+        r = self.client._post(params)
+        return Message.from_dict(r.json())
+
+    def stream(self, **params):
+        return MessageStream(self.client._post(dict(params, stream=True), stream=True))
+
+
+class Anthropic:
+    def __init__(self, api_key=None, base_url=API_URL, timeout=transport.API_TIMEOUT):
+        self.api_key = api_key or _load_api_key()
+        self.base_url = base_url
+        self.timeout = timeout
+        self.messages = Messages(self)
+
+    def _post(self, payload, stream=False):
+        r = transport.post(self.base_url, headers=_headers(self.api_key), json=payload,
+                           stream=stream, timeout=self.timeout)
+        if r.status_code != 200:
+            try:
+                message = r.json().get("error", {}).get("message", r.text)
+            except ValueError:
+                message = r.text
+            r.close()
+            raise APIError(r.status_code, message)
+        return r
+
+
+# === asyncio ===
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(ASYNC_WORKERS, thread_name_prefix="anthropic")
+    return _executor
+
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+
+
+class AsyncMessageStream:
+    def __init__(self, start):
+        self._start = start
+        self.stream = None
+
+    async def __aenter__(self):
+        self.stream = await _run(self._start)
+        return self
+
+    async def __aexit__(self, *exc):
+        await _run(self.stream.close)
+
+    async def _next(self, it):
+        return await _run(next, it, None)
+
+    @property
+    async def text_stream(self):
+        it = self.stream.text_stream
+        while True:
+            piece = await self._next(it)
+            if piece is None:
+                break
+            yield piece
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        it = iter(self.stream)
+        while True:
+            event = await self._next(it)
+            if event is None:
+                break
+            yield event
+
+    async def get_final_message(self):
+        return await _run(self.stream.get_final_message)
+
+
+class AsyncMessages:
+    def __init__(self, client):
+        self.sync = Messages(client)
+
+    async def create(self, **params):
+        return await _run(lambda: self.sync.create(**params))
+
+    def stream(self, **params):
+        return AsyncMessageStream(lambda: self.sync.stream(**params))
+
+
+class AsyncAnthropic(Anthropic):
+    """То же, что Anthropic, но messages.* - корутины"""
+
+    def __init__(self, api_key=None, base_url=API_URL, timeout=transport.API_TIMEOUT):
+        super().__init__(api_key, base_url, timeout)
+        self.messages = AsyncMessages(self)
+
+
+# === Старый интерфейс ===
 
 def send_message(user_text, history, system_prompt, image_path=None):
     api_key = _load_api_key()
@@ -42,12 +329,6 @@ def send_message(user_text, history, system_prompt, image_path=None):
     if not api_key:
         return "API ключ не найден. Проверь config.json."
 
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": VERSION,
-        "content-type": "application/json",
-    }
-
     messages = history[:]
 
     if image_path:
@@ -55,36 +336,19 @@ def send_message(user_text, history, system_prompt, image_path=None):
             "role": "user",
             "content": [
                 {"type": "text", "text": user_text},
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": _img_to_base64(image_path),
-                    },
-                },
+                attachments.image_block(image_path),
             ],
         })
     else:
         messages.append({"role": "user", "content": user_text})
 
-    payload = {
-        "model": "claude-3-5-sonnet-20240620",
-        "system": system_prompt,
-        "messages": messages,
-        "max_tokens": 512,
-        "temperature": 1.0,
-    }
-
     try:
-        r = requests.post(API_URL, headers=headers, json=payload, timeout=120)
-        data = r.json()
-    except Exception as e:
+        return Anthropic(api_key).messages.create(
+            model=MODEL,
+            system=system_prompt,
+            messages=messages,
+            max_tokens=MAX_TOKENS,
+            temperature=1.0,
+        ).text
+    except Exception:
         return "Ошибка соединения с API"
-
-    text = ""
-    for b in data.get("content", []):
-        if b.get("type") == "text":
-            text += b.get("text", "")
-
-    return text
\ No newline at end of file
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Подготовка картинок к отправке
+
+Фото с телефона (12 Мп, 4-6 МБ) модели не нужно целиком: больше ~1568px
+по длинной стороне она всё равно уменьшает сама. Поэтому перед отправкой:
+  - поворот по EXIF, затем EXIF (и GPS в нём) выбрасывается
+  - уменьшение до MAX_EDGE / MAX_PIXELS
+  - JPEG, или WebP если есть прозрачность
+Результат кэшируется по sha256 исходного файла в cache/images/, так что
+повторная отправка и повтор после ошибки не пережимают и не читают
+оригинал заново. Без Pillow файл уходит как есть.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+    PIL = True
+except ImportError:
+    PIL = False
+
+MAX_EDGE = 1568
+MAX_PIXELS = 1150000
+JPEG_QUALITY = 85
+WEBP_QUALITY = 85
+CACHE_LIMIT = 50 * 1024 * 1024     # байт в cache/images
+VERSION = 1                         # сменить при смене параметров выше
+
+CACHE_DIR = Path.home() / ".claude_home" / "cache" / "images"
+
+MEDIA_TYPES = {
+    "jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png",
+    "gif": "image/gif", "webp": "image/webp", "bmp": "image/bmp",
+}
+EXTENSIONS = {"image/jpeg": "jpg", "image/webp": "webp"}
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _target_size(width, height):
+    scale = min(1.0, MAX_EDGE / max(width, height), (MAX_PIXELS / (width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def encode(path):
+    """(media_type, bytes) - уменьшенная картинка без EXIF"""
+    with Image.open(path) as img:
+        img.seek(0)                         # у GIF/анимированных - первый кадр
+        # JPEG декодируется сразу в уменьшенном виде (в разы быстрее)
+        img.draft("RGB", _target_size(*img.size))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("P", "LA", "PA"):
+            img = img.convert("RGBA")
+        alpha = img.mode == "RGBA" and img.getextrema()[3][0] < 255
+        size = _target_size(*img.size)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+        out = io.BytesIO()
+        if alpha:
+            img.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+            return "image/webp", out.getvalue()
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return "image/jpeg", out.getvalue()
+
+
+class ImageCache:
+    def __init__(self, cache_dir=CACHE_DIR, limit=CACHE_LIMIT):
+        self.dir = Path(cache_dir)
+        self.limit = limit
+        self.lock = threading.Lock()
+        self._hashes = {}       # (путь, размер, mtime) -> sha256
+        self._pending = {}      # путь -> Future
+        self._executor = None
+
+    def _key(self, path):
+        st = os.stat(path)
+        stamp = (str(path), st.st_size, st.st_mtime_ns)
+        digest = self._hashes.get(stamp)
+        if digest is None:
+            digest = _sha256(path)
+            self._hashes[stamp] = digest
+        return f"{digest[:32]}-v{VERSION}"
+
+    def _cached(self, key):
+        for media_type, ext in EXTENSIONS.items():
+            p = self.dir / f"{key}.{ext}"
+            if p.exists():
+                os.utime(p)             # для вытеснения давно не нужных
+                return media_type, p.read_bytes()
+        return None
+
+    def _store(self, key, media_type, data):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        p = self.dir / f"{key}.{EXTENSIONS[media_type]}"
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+        self._evict()
+
+    def _evict(self):
+        files = sorted(self.dir.glob("*-v*.*"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for p in files:
+            if total <= self.limit:
+                break
+            total -= p.stat().st_size
+            p.unlink()
+
+    def _prepare(self, path):
+        if not PIL:
+            ext = str(path).lower().rsplit(".", 1)[-1]
+            return MEDIA_TYPES.get(ext, "image/jpeg"), Path(path).read_bytes()
+        key = self._key(path)
+        found = self._cached(key)
+        if found:
+            return found
+        media_type, data = encode(path)
+        self._store(key, media_type, data)
+        return media_type, data
+
+    # === API ===
+
+    def prefetch(self, path):
+        """Начать подготовку в фоне (например, сразу после выбора файла)"""
+        with self.lock:
+            if path not in self._pending:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(1, thread_name_prefix="attachments")
+                self._pending[path] = self._executor.submit(self._prepare, path)
+            return self._pending[path]
+
+    def prepare(self, path):
+        """(media_type, bytes); ждёт фоновую подготовку, если она идёт"""
+        future = self.prefetch(path)
+        try:
+            return future.result()
+        finally:
+            with self.lock:
+                if self._pending.get(path) is future:
+                    del self._pending[path]
+
+    def image_block(self, path):
+        """Блок content для Messages API"""
+        media_type, data = self.prepare(path)
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": base64.b64encode(data).decode("ascii"),
+            },
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(cache_dir=None):
+    """Общий кэш; cache_dir учитывается при первом вызове"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(cache_dir or CACHE_DIR)
+        return _cache
+
+
+def prefetch(path):
+    return get_cache().prefetch(path)
+
+
+def image_block(path):
+    return get_cache().image_block(path)
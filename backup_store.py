@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Инкрементальные бэкапы с дедупликацией
+
+backups/
+  objects/ab/abcdef...[.z]  - куски файлов по sha256 (.z - сжатые zlib)
+  snapshots/NAME.json       - манифест: файл -> размер, mtime, куски
+
+Неизменённый файл (тот же размер и mtime) берётся из прошлого манифеста
+без чтения. Изменённый режется на куски по CHUNK байт, и пишутся только
+новые куски - у дописываемого журнала это обычно только последний.
+
+    python backup_store.py DATA_DIR list
+    python backup_store.py DATA_DIR verify NAME
+    python backup_store.py DATA_DIR restore NAME [TARGET]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+
+CHUNK = 1024 * 1024
+
+
+class BackupStore:
+    def __init__(self, root, compress=True):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.snapshots = self.root / "snapshots"
+        self.compress = compress
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.snapshots.mkdir(parents=True, exist_ok=True)
+
+    # === Куски ===
+
+    def _object_path(self, digest):
+        return self.objects / digest[:2] / digest[2:]
+
+    def _find_object(self, digest):
+        p = self._object_path(digest)
+        z = p.with_name(p.name + ".z")
+        if z.exists():
+            return z
+        if p.exists():
+            return p
+        return None
+
+    def _put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find_object(digest):
+            return digest, 0
+        p = self._object_path(digest)
+        p.parent.mkdir(exist_ok=True)
+        if self.compress:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data):
+                data = packed
+                p = p.with_name(p.name + ".z")
+        tmp = p.with_name(p.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, p)
+        return digest, len(data)
+
+    def _get(self, digest):
+        p = self._find_object(digest)
+        if p is None:
+            raise FileNotFoundError(digest)
+        data = p.read_bytes()
+        if p.name.endswith(".z"):
+            data = zlib.decompress(data)
+        return data
+
+    # === Снимки ===
+
+    def list(self):
+        return sorted(p.stem for p in self.snapshots.glob("*.json"))
+
+    def load_manifest(self, name):
+        with open(self.snapshots / f"{name}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _latest_files(self):
+        names = self.list()
+        if not names:
+            return {}
+        try:
+            return self.load_manifest(names[-1]).get("files", {})
+        except Exception:
+            return {}
+
+    def snapshot(self, files, name=None):
+        """Снимок. files: {относительный путь: Path}"""
+        if not name:
+            name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        prev = self._latest_files()
+        entries = {}
+        written = 0
+
+        for rel, path in sorted(files.items()):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            old = prev.get(rel)
+            if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns \
+                    and all(self._find_object(c) for c in old["chunks"]):
+                entries[rel] = old
+                continue
+
+            chunks = []
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(CHUNK)
+                    if not data:
+                        break
+                    digest, n = self._put(data)
+                    chunks.append(digest)
+                    written += n
+            entries[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "chunks": chunks}
+
+        manifest = {
+            "name": name,
+            "created": datetime.now().isoformat(),
+            "written": written,
+            "files": entries,
+        }
+        path = self.snapshots / f"{name}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path
+
+    def verify(self, name):
+        """Проверить, что все куски на месте и целы. Возвращает список проблем"""
+        problems = []
+        for rel, entry in self.load_manifest(name)["files"].items():
+            size = 0
+            for digest in entry["chunks"]:
+                try:
+                    data = self._get(digest)
+                except FileNotFoundError:
+                    problems.append(f"{rel}: нет куска {digest[:12]}")
+                    continue
+                except zlib.error:
+                    problems.append(f"{rel}: кусок {digest[:12]} не распаковывается")
+                    continue
+                if hashlib.sha256(data).hexdigest() != digest:
+                    problems.append(f"{rel}: кусок {digest[:12]} повреждён")
+                size += len(data)
+            if size != entry["size"] and not any(p.startswith(rel + ":") for p in problems):
+                problems.append(f"{rel}: размер {size} вместо {entry['size']}")
+        return problems
+
+    def restore(self, name, target):
+        """Восстановить снимок в папку target"""
+        target = Path(target)
+        files = self.load_manifest(name)["files"]
+        for rel, entry in files.items():
+            dst = target / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(dst.name + ".restore")
+            with open(tmp, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self._get(digest))
+            os.replace(tmp, dst)
+        return len(files)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+
+    data_dir, cmd = Path(argv[0]), argv[1]
+    store = BackupStore(data_dir / "backups")
+
+    if cmd == "list":
+        for name in store.list():
+            print(name)
+    elif cmd == "verify" and len(argv) > 2:
+        problems = store.verify(argv[2])
+        for p in problems:
+            print(p)
+        print("OK" if not problems else f"Проблем: {len(problems)}")
+        return 1 if problems else 0
+    elif cmd == "restore" and len(argv) > 2:
+        target = Path(argv[3]) if len(argv) > 3 else data_dir
+        n = store.restore(argv[2], target)
+        print(f"Восстановлено файлов: {n} -> {target}")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
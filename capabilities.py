@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+import codecs
 import requests
 from datetime import datetime
+from html.parser import HTMLParser
+
+import transport
+import capability_cache
 
 
 def search_web(query):
     try:
         search_url = "https://html.duckduckgo.com/html/"
         headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.post(search_url, data={"q": query}, headers=headers, timeout=15)
+        response = transport.post(search_url, data={"q": query}, headers=headers, timeout=15)
 
         if response.status_code == 200:
             import re
@@ -25,27 +30,110 @@ def search_web(query):
     return None
 
 
-def fetch_webpage(url):
+FETCH_CHARS = 5000                  # сколько текста страницы отдаём
+FETCH_MAX_BYTES = 2 * 1024 * 1024   # больше не качаем, даже если текста мало
+FETCH_CHUNK = 16 * 1024
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+# Что бывает в <head>; любой другой тег значит, что </head> пропустили и начался body
+HEAD_TAGS = {"title", "meta", "link", "base", "style", "script", "noscript", "template"}
+# Между ними - пробел; внутри строчных (<b>, <a>, <span>) текст склеивается как есть
+BLOCK_TAGS = {
+    "p", "div", "br", "hr", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr", "td", "th",
+    "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "header", "footer", "nav",
+    "main", "aside", "blockquote", "pre", "form", "figure", "figcaption", "body", "title",
+}
+
+
+class _TextExtractor(HTMLParser):
+    """Видимый текст HTML по мере поступления, до limit символов"""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.skip = 0
+        self.in_head = False
+        self.space = True
+
+    @property
+    def full(self):
+        return self.size >= self.limit
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "head":
+            self.in_head = True
+        elif self.in_head and tag not in HEAD_TAGS:
+            self.in_head = False
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        if tag in BLOCK_TAGS:
+            self.space = True
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+        if tag in SKIP_TAGS and self.skip:
+            self.skip -= 1
+        if tag in BLOCK_TAGS:
+            self.space = True
+
+    def handle_data(self, data):
+        if self.skip or self.in_head or self.full:
+            return
+        words = data.split()
+        if not words:
+            self.space = self.space or bool(data)
+            return
+        text = " ".join(words)
+        if self.parts and (self.space or data[0].isspace()):
+            text = " " + text
+        self.space = data[-1].isspace()
+        text = text[:self.limit - self.size]
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self):
+        return "".join(self.parts).strip()
+
+
+def fetch_webpage(url, limit=FETCH_CHARS):
     try:
         headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, headers=headers, timeout=15)
-
-        if response.status_code == 200:
-            import re
-            text = response.text
-            text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
-            text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL)
-            text = re.sub(r'<[^>]+>', ' ', text)
-            text = re.sub(r'\s+', ' ', text).strip()
-            return text[:5000]
+        # Тело читается кусками и только пока не набрался текст
+        response = transport.get(url, headers=headers, timeout=15, stream=True)
+        with response:
+            if response.status_code != 200:
+                return None
+            ctype = response.headers.get("content-type", "").lower()
+            charset = response.encoding if "charset" in ctype else "utf-8"
+            try:
+                decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            except LookupError:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            html = "html" in ctype or not ctype
+            parser = _TextExtractor(limit)
+            received = 0
+            for chunk in response.iter_content(FETCH_CHUNK):
+                received += len(chunk)
+                text = decoder.decode(chunk)
+                if html:
+                    parser.feed(text)
+                else:
+                    parser.handle_data(text)
+                if parser.full or received >= FETCH_MAX_BYTES:
+                    break
+            if html and not parser.full:
+                parser.feed(decoder.decode(b"", final=True))
+                parser.close()
+            return parser.text()
     except Exception as e:
         return f"[Fetch error: {e}]"
-    return None
 
 
 def get_weather(city="Bishkek"):
     try:
-        response = requests.get(f"https://wttr.in/{city}?format=j1", timeout=10)
+        response = transport.get(f"https://wttr.in/{city}?format=j1", timeout=10)
         if response.status_code == 200:
             data = response.json()
             current = data.get("current_condition", [{}])[0]
@@ -72,7 +160,7 @@ def get_time_info():
 def get_wiki(topic):
     try:
         url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{requests.utils.quote(topic)}"
-        response = requests.get(url, timeout=10)
+        response = transport.get(url, timeout=10)
         if response.status_code == 200:
             data = response.json()
             return f"**{data.get('title', topic)}**\n\n{data.get('extract', 'No info')}"
@@ -134,7 +222,8 @@ CAPABILITIES = {
 def execute_capability(name, *args, **kwargs):
     if name in CAPABILITIES:
         try:
-            return CAPABILITIES[name](*args, **kwargs)
+            # Сеть - только если свежего результата нет, см. capability_cache
+            return capability_cache.get_cache().call(name, CAPABILITIES[name], *args, **kwargs)
         except Exception as e:
             return f"[Error {name}: {e}]"
     return f"[Unknown: {name}]"
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Кэш результатов capabilities (поиск, страницы, погода, wiki)
+
+  - у каждой capability свой срок жизни (TTLS), остальные не кэшируются
+  - в памяти не больше MAX_ENTRIES записей, вытесняются давно не нужные
+  - второй уровень на диске (cache/capabilities/), переживает перезапуск;
+    не больше MAX_DISK_BYTES, вытесняются файлы с самым старым mtime,
+    просроченное чистит prune() при запуске
+  - одинаковые одновременные вызовы ждут один запрос, а не идут в сеть
+    каждый сам (singleflight)
+Ошибки ("[Fetch error: ...]", "[Error fetch: ...]" и т.п.) и пустые
+ответы не кэшируются.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+# Секунды; чего нет в словаре - не кэшируется (уведомления, буфер и т.п.)
+TTLS = {
+    "weather": 10 * 60,
+    "search": 60 * 60,
+    "fetch": 60 * 60,
+    "wiki": 24 * 60 * 60,
+}
+
+MAX_ENTRIES = 256
+MAX_DISK_BYTES = 8 * 1024 * 1024
+CACHE_DIR = Path.home() / ".claude_home" / "cache" / "capabilities"
+
+
+# Как capabilities/tools сообщают об ошибке; "[" в начале настоящей
+# страницы (JSON-массив и т.п.) ошибкой не считается
+ERROR_RE = re.compile(r"^\[(?:\w+ error: |Error \w+: |Unknown: |Timeout )")
+
+
+def is_error(result):
+    return isinstance(result, str) and ERROR_RE.match(result) is not None
+
+
+def _cacheable(result):
+    if not result:
+        return False    # None, "", [], {}
+    return not is_error(result)
+
+
+class CapabilityCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, ttls=TTLS, disk_limit=MAX_DISK_BYTES):
+        self.dir = Path(cache_dir) if cache_dir else None
+        self.max_entries = max_entries
+        self.disk_limit = disk_limit
+        self.ttls = dict(ttls)
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()   # ключ -> (истекает, результат)
+        self._inflight = {}             # ключ -> Future
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0                 # дождались чужого запроса
+        self.evictions = 0
+
+    @staticmethod
+    def key(name, args, kwargs):
+        return name + ":" + json.dumps([list(args), kwargs], sort_keys=True, ensure_ascii=False)
+
+    # === Диск ===
+
+    def _disk_path(self, key):
+        return self.dir / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _disk_get(self, key, now):
+        if not self.dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key or entry.get("expires", 0) <= now:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)              # для вытеснения давно не нужных
+        except OSError:
+            pass
+        return entry["expires"], entry["value"]
+
+    def _disk_put(self, key, expires, value):
+        if not self.dir:
+            return
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(key)
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "expires": expires, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self._evict()
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def _evict(self):
+        """Самые давние файлы - пока диск не уложится в disk_limit"""
+        files = []
+        for path in self.dir.glob("*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in files:
+            if total <= self.disk_limit:
+                break
+            total -= size
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def prune(self):
+        """Удалить с диска просроченное и лишнее сверх disk_limit"""
+        if not self.dir or not self.dir.exists():
+            return 0
+        now = time.time()
+        removed = 0
+        for path in self.dir.glob("*.json"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    expired = json.load(f).get("expires", 0) <= now
+            except (OSError, ValueError):
+                expired = True
+            if expired:
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed + self._evict()
+
+    # === Память ===
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, expires, value):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # === API ===
+
+    def call(self, name, fn, *args, **kwargs):
+        """fn(*args, **kwargs) через кэш capability name"""
+        ttl = self.ttls.get(name)
+        if not ttl:
+            return fn(*args, **kwargs)
+
+        key = self.key(name, args, kwargs)
+        now = time.time()
+        with self.lock:
+            entry = self._get(key, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                    self._put(key, *entry)
+                result = entry[1]
+            else:
+                with self.lock:
+                    self.misses += 1
+                result = fn(*args, **kwargs)
+                if _cacheable(result):
+                    expires = time.time() + ttl
+                    with self.lock:
+                        self._put(key, expires, result)
+                    self._disk_put(key, expires, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self._inflight.pop(key, None)
+
+    def invalidate(self, name=None):
+        """Сбросить всё или только одну capability (память и диск)"""
+        with self.lock:
+            for key in [k for k in self._entries if name is None or k.startswith(name + ":")]:
+                del self._entries[key]
+        if self.dir and self.dir.exists():
+            for path in self.dir.glob("*.json"):
+                try:
+                    if name is not None:
+                        with open(path, "r", encoding="utf-8") as f:
+                            if not json.load(f).get("key", "").startswith(name + ":"):
+                                continue
+                    path.unlink()
+                except (OSError, ValueError):
+                    pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.shared
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "evictions": self.evictions,
+                "hit_ratio": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(cache_dir=None):
+    """Общий кэш; cache_dir учитывается при первом вызове"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CapabilityCache(cache_dir or CACHE_DIR)
+        return _cache
+
+
+def stats():
+    return get_cache().stats()
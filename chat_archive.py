@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Архив старых дневных файлов chats/
+
+Дневные chats/YYYY-MM-DD.jsonl старше N дней упаковываются в помесячные
+архивы:
+  chats/archive/YYYY-MM[.N].arc     - сжатые дни подряд (zlib, lzma - если есть)
+  chats/archive/YYYY-MM.index.json  - день -> файл, смещение, длина, кодек
+Каждый день сжат отдельно, поэтому день читается без распаковки месяца.
+
+Упаковку можно повторять после падения: в индексе запомнен хэш
+последнего влитого дневного файла, и тот же файл второй раз не
+вливается. Перепакованный день оставляет в .arc мёртвую копию; когда
+мёртвого больше трети, месяц переписывается в новый YYYY-MM.N.arc,
+индекс переключается на него, и только потом старый файл удаляется.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+CODECS = {
+    "zlib": (lambda b: zlib.compress(b, 9), zlib.decompress),
+}
+
+# _lzma в python-for-android есть только с рецептом liblzma
+try:
+    import lzma
+    CODECS["lzma"] = (lambda b: lzma.compress(b, preset=6), lzma.decompress)
+except ImportError:
+    pass
+
+
+def _parse(raw):
+    msgs = []
+    for line in raw.decode("utf-8", errors="replace").splitlines():
+        if line.strip():
+            try:
+                msgs.append(json.loads(line))
+            except ValueError:
+                pass
+    return msgs
+
+
+class ChatArchive:
+    def __init__(self, chats_dir, codec="zlib"):
+        if codec not in CODECS:
+            raise ValueError(f"Кодек недоступен: {codec}")
+        self.chats_dir = Path(chats_dir)
+        self.dir = self.chats_dir / "archive"
+        self.codec = codec
+        self.lock = threading.Lock()
+        self._indexes = {}
+
+    # === Индексы архивов ===
+
+    def _index_path(self, month):
+        return self.dir / f"{month}.index.json"
+
+    def _arc_path(self, month, entry=None):
+        if entry and entry.get("file"):
+            return self.dir / entry["file"]
+        return self.dir / f"{month}.arc"
+
+    def _current_arc(self, month, index):
+        """Файл, в который сейчас дописывается месяц"""
+        entry = max(index.values(), key=lambda e: e["offset"], default=None)
+        return self._arc_path(month, entry)
+
+    def _index(self, month):
+        if month not in self._indexes:
+            try:
+                with open(self._index_path(month), "r", encoding="utf-8") as f:
+                    self._indexes[month] = json.load(f)
+            except (OSError, ValueError):
+                self._indexes[month] = {}
+        return self._indexes[month]
+
+    def _save_index(self, month, index):
+        path = self._index_path(month)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+        self._indexes[month] = index
+
+    def months(self):
+        if not self.dir.exists():
+            return []
+        return sorted(p.name[:-len(".index.json")] for p in self.dir.glob("*.index.json"))
+
+    # === Упаковка ===
+
+    def tier(self, max_age_days=30, today=None):
+        """Упаковать дни старше max_age_days. Возвращает число упакованных"""
+        today = today or datetime.now().date()
+        cutoff = (today - timedelta(days=max_age_days)).isoformat()
+        packed = 0
+        with self.lock:
+            for shard in sorted(self.chats_dir.glob("*.jsonl")):
+                day = shard.stem
+                if len(day) != 10 or day >= cutoff:
+                    continue
+                self._pack(day, shard)
+                packed += 1
+        return packed
+
+    def _pack(self, day, shard):
+        month = day[:7]
+        index = dict(self._index(month))
+        raw = shard.read_bytes()
+        digest = hashlib.sha1(raw).hexdigest()
+
+        # Этот файл уже влит, но до удаления не дошло (упали) - не дублируем
+        if index.get(day, {}).get("shard") == digest:
+            shard.unlink()
+            return
+
+        # День уже в архиве (дописали задним числом) - склеиваем
+        if day in index:
+            raw = self._read_member(month, index[day]) + raw
+
+        compress = CODECS[self.codec][0]
+        data = compress(raw)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        arc = self._current_arc(month, index)
+        with open(arc, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        index[day] = {
+            "offset": offset,
+            "length": len(data),
+            "codec": self.codec,
+            "count": raw.count(b"\n"),
+            "size": len(raw),
+            "file": arc.name,
+            "shard": digest,
+        }
+        self._save_index(month, index)
+        shard.unlink()
+        self._maybe_compact(month, arc)
+
+    def _maybe_compact(self, month, arc):
+        index = self._index(month)
+        live = sum(e["length"] for e in index.values() if self._arc_path(month, e) == arc)
+        try:
+            dead = arc.stat().st_size - live
+        except OSError:
+            return
+        if dead * 3 > live + dead:
+            self._compact(month, index, arc)
+
+    def _compact(self, month, index, arc):
+        """Переписать месяц без мёртвых копий в новый файл"""
+        generation = arc.name[len(month):-len(".arc")].lstrip(".")
+        new = self.dir / f"{month}.{int(generation or 0) + 1}.arc"
+        fresh = {}
+        with open(new, "wb") as out:
+            for day, entry in sorted(index.items(), key=lambda kv: kv[1]["offset"]):
+                with open(self._arc_path(month, entry), "rb") as f:
+                    f.seek(entry["offset"])
+                    data = f.read(entry["length"])
+                fresh[day] = dict(entry, offset=out.tell(), file=new.name)
+                out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        # Сначала индекс на новый файл, потом удаление старых: упасть можно где угодно
+        self._save_index(month, fresh)
+        for entry in index.values():
+            old = self._arc_path(month, entry)
+            if old != new:
+                old.unlink(missing_ok=True)
+
+    def _read_member(self, month, entry):
+        with open(self._arc_path(month, entry), "rb") as f:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+        codec = CODECS.get(entry["codec"])
+        if codec is None:
+            raise OSError(f"Архив {entry['codec']} не прочитать: кодек недоступен")
+        return codec[1](data)
+
+    # === Чтение ===
+
+    def days(self):
+        """Все дни: и из дневных файлов, и из архивов"""
+        days = {p.stem for p in self.chats_dir.glob("*.jsonl") if len(p.stem) == 10}
+        for month in self.months():
+            days.update(self._index(month))
+        return sorted(days)
+
+    def read_day(self, day):
+        """Сообщения за день YYYY-MM-DD"""
+        msgs = []
+        entry = self._index(day[:7]).get(day)
+        if entry:
+            msgs = _parse(self._read_member(day[:7], entry))
+        shard = self.chats_dir / f"{day}.jsonl"
+        if shard.exists():
+            raw = shard.read_bytes()
+            # Уже влит в архив, но не удалён (см. _pack)
+            if not (entry and entry.get("shard") == hashlib.sha1(raw).hexdigest()):
+                msgs += _parse(raw)
+        return msgs
+
+    def iter_messages(self, since=None, until=None):
+        for day in self.days():
+            if since and day < since[:10]:
+                continue
+            if until and day[:len(until)] > until:
+                break
+            yield from self.read_day(day)
@@ -4,17 +4,20 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from message_log import MessageLog
+
 try:
     import requests
 except ImportError:
     print("pip install requests")
     exit(1)
 
+from api_client import Anthropic
+
 API_KEY = ""
 MODEL = "claude-sonnet-4-5-20250929"
 TEMPERATURE = 1.0
 MAX_TOKENS = 8192
-API_URL = "https://api.anthropic.com/v1/messages"
 
 DATA_DIR = Path.home() / '.claude_home'
 DATA_DIR.mkdir(exist_ok=True)
@@ -29,30 +32,24 @@ You are home.
 """
 
 
-def load_history():
-    file = DATA_DIR / 'chat_history.json'
-    if file.exists():
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            pass
-    return []
+LOG = MessageLog(DATA_DIR / 'chat_history.jsonl', legacy_path=DATA_DIR / 'chat_history.json')
 
 
-def save_history(history):
-    file = DATA_DIR / 'chat_history.json'
-    with open(file, 'w', encoding='utf-8') as f:
-        json.dump(history[-100:], f, ensure_ascii=False, indent=2)
+def load_history():
+    try:
+        return LOG.read_all()
+    except:
+        return []
 
 
 def add_message(history, role, content):
-    history.append({
+    msg = {
         "role": role,
         "content": content,
         "timestamp": datetime.now().isoformat()
-    })
-    save_history(history)
+    }
+    history.append(msg)
+    LOG.append(msg)
     return history
 
 
@@ -61,45 +58,19 @@ def get_api_messages(history, limit=30):
 
 
 def send_message(api_key, messages):
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01"
-    }
-
-    data = {
-        "model": MODEL,
-        "max_tokens": MAX_TOKENS,
-        "temperature": TEMPERATURE,
-        "system": SYSTEM_PROMPT,
-        "messages": messages,
-        "stream": True
-    }
-
-    response = requests.post(API_URL, headers=headers, json=data, stream=True)
-
-    if response.status_code != 200:
-        raise Exception(f"API Error: {response.status_code} - {response.text}")
-
+    client = Anthropic(api_key=api_key)
     full_text = ""
 
-    for line in response.iter_lines():
-        if line:
-            line = line.decode('utf-8')
-            if line.startswith('data: '):
-                data_str = line[6:]
-                if data_str == '[DONE]':
-                    break
-                try:
-                    data = json.loads(data_str)
-                    if data.get('type') == 'content_block_delta':
-                        delta = data.get('delta', {})
-                        if delta.get('type') == 'text_delta':
-                            text = delta.get('text', '')
-                            print(text, end='', flush=True)
-                            full_text += text
-                except json.JSONDecodeError:
-                    pass
+    with client.messages.stream(
+        model=MODEL,
+        max_tokens=MAX_TOKENS,
+        temperature=TEMPERATURE,
+        system=SYSTEM_PROMPT,
+        messages=messages
+    ) as stream:
+        for text in stream.text_stream:
+            print(text, end='', flush=True)
+            full_text += text
 
     print("\n")
     return full_text
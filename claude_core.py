@@ -1,25 +1,26 @@
 # -*- coding: utf-8 -*-
 """Claude Home - Samsung S25 Ultra"""
 
+import startup  # первым: от него считаются замеры старта
+
 import threading
 import json
-import base64
 import os
 from datetime import datetime
 from pathlib import Path
 
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.label import Label
-from kivy.uix.image import Image as KivyImage
+from kivy.uix.widget import Widget
 from kivy.clock import Clock
 from kivy.core.window import Window
-from kivy.uix.popup import Popup
-from kivy.graphics import Color, RoundedRectangle
-from kivy.core.clipboard import Clipboard
+from kivy.graphics import Color, Rectangle, RoundedRectangle
 from kivy.metrics import dp
 
 # === КЛАВИАТУРА ===
@@ -38,20 +39,17 @@ try:
 except:
     pass
 
-from api_client import Anthropic
-from memory import Memory
+# Тяжёлое (memory, api_client/requests, attachments/PIL, tools, plyer,
+# Popup и т.п.) импортируется позже - в _load_backend или там, где нужно
+import instrumentation
+import memory_store
+import request_builder
+from layout_cache import LayoutCache, Precomputer
 from system_prompt import SYSTEM_PROMPT
 
-try:
-    from claude_core import SELF_KNOWLEDGE
-except:
-    SELF_KNOWLEDGE = ""
-
-try:
-    from plyer import filechooser, vibrator
-    PLYER = True
-except:
-    PLYER = False
+# Раньше было "from claude_core import SELF_KNOWLEDGE": при запуске как
+# __main__ это второй раз исполняло весь модуль, а имени так и не находило
+SELF_KNOWLEDGE = ""
 
 try:
     from android.permissions import request_permissions, Permission
@@ -70,6 +68,14 @@ RED_LIGHT = [0.65, 0.2, 0.2, 1]
 TEXT_WHITE = [0.92, 0.88, 0.85, 1]
 TEXT_GRAY = [0.55, 0.55, 0.55, 1]
 
+# Шапка, отступы и промежуток пузыря сверх высоты текста
+BUBBLE_CHROME = dp(44)
+FONT_SIZE = dp(15)
+# Сколько сообщений показываем при старте и подгружаем за раз при прокрутке вверх
+HISTORY_PAGE = 50
+# Потоковый ответ перерисовывается не чаще (с): каждый раз раскладывается весь текст
+STREAM_EVERY = 0.1
+
 MODEL = "claude-sonnet-4-5-20250929"
 MAX_TOKENS = 16384
 TEMPERATURE = 1.0
@@ -89,14 +95,19 @@ def get_shared_dir():
     return Path('/sdcard/Claude')
 
 
-def load_api_key():
-    global API_KEY
+def load_config():
     cfg = get_data_dir() / 'config.json'
     if cfg.exists():
         try:
-            API_KEY = json.load(open(cfg))['api_key']
+            return json.load(open(cfg))
         except:
             pass
+    return {}
+
+
+def load_api_key():
+    global API_KEY
+    API_KEY = load_config().get('api_key', API_KEY)
     return API_KEY
 
 
@@ -104,71 +115,86 @@ def save_api_key(key):
     global API_KEY
     d = get_data_dir()
     d.mkdir(parents=True, exist_ok=True)
-    json.dump({'api_key': key}, open(d / 'config.json', 'w'))
+    # Остальные настройки (например "metrics") не трогаем
+    cfg = dict(load_config(), api_key=key)
+    json.dump(cfg, open(d / 'config.json', 'w'))
     API_KEY = key
 
 
 load_api_key()
+startup.mark("imports")
+
+
+def _time_label(ts):
+    ts = ts or datetime.now().strftime("%H:%M")
+    if isinstance(ts, str) and 'T' in ts:
+        try:
+            ts = datetime.fromisoformat(ts).strftime("%H:%M")
+        except:
+            pass
+    return str(ts)
 
 
-class MessageBubble(BoxLayout):
-    def __init__(self, text, is_claude=False, timestamp=None, **kwargs):
+class MessageBubble(RecycleDataViewBehavior, BoxLayout):
+    """Вид одного сообщения; RecycleView переиспользует его для разных данных"""
+    
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'vertical'
         self.size_hint_y = None
         self.padding = [dp(14), dp(10)]
         self.spacing = dp(6)
-        self._text = text
+        self._text = ""
         
-        bg = RED_DARK if is_claude else DARK2
         with self.canvas.before:
-            Color(*bg)
+            self.bg_color = Color(*DARK2)
             self.bg = RoundedRectangle(pos=self.pos, size=self.size, radius=[dp(18)])
         self.bind(pos=self._upd, size=self._upd)
         
-        name = "Claude" if is_claude else "Lien"
-        ts = timestamp or datetime.now().strftime("%H:%M")
-        if isinstance(ts, str) and 'T' in ts:
-            try:
-                ts = datetime.fromisoformat(ts).strftime("%H:%M")
-            except:
-                pass
-        
         header = BoxLayout(size_hint_y=None, height=dp(22))
         
-        nm = Label(
-            text=name, font_size=dp(13),
-            color=RED_LIGHT if is_claude else TEXT_GRAY,
-            size_hint_x=None, width=dp(70), halign='left'
-        )
-        nm.bind(size=nm.setter('text_size'))
+        self.nm = Label(font_size=dp(13), size_hint_x=None, width=dp(70), halign='left')
+        self.nm.bind(size=self.nm.setter('text_size'))
         
-        tm = Label(text=str(ts), font_size=dp(11), color=TEXT_GRAY, halign='right')
-        tm.bind(size=tm.setter('text_size'))
+        self.tm = Label(font_size=dp(11), color=TEXT_GRAY, halign='right')
+        self.tm.bind(size=self.tm.setter('text_size'))
         
-        header.add_widget(nm)
-        header.add_widget(tm)
+        header.add_widget(self.nm)
+        header.add_widget(self.tm)
         
-        self.lbl = Label(
-            text=text, font_size=dp(15), color=TEXT_WHITE,
-            size_hint_y=None, halign='left', valign='top',
-            text_size=(Window.width - dp(70), None), markup=True
-        )
-        self.lbl.bind(texture_size=self._resize)
+        # Текст - готовая текстура из кэша раскладки, см. layout_cache
+        self.body = Widget(size_hint_y=None)
+        with self.body.canvas:
+            Color(1, 1, 1, 1)
+            self.text_rect = Rectangle()
+        self.body.bind(pos=self._place_text, size=self._place_text)
         
         self.add_widget(header)
-        self.add_widget(self.lbl)
+        self.add_widget(self.body)
         
         self._touch_start = None
     
+    def refresh_view_attrs(self, rv, index, data):
+        is_claude = data['is_claude']
+        self._text = data['text']
+        self.bg_color.rgba = RED_DARK if is_claude else DARK2
+        self.nm.text = "Claude" if is_claude else "Lien"
+        self.nm.color = RED_LIGHT if is_claude else TEXT_GRAY
+        self.tm.text = data['time']
+        tex = rv.layout_cache.texture(data['text'], data['text_width'], FONT_SIZE, data.get('slot'))
+        self.text_rect.texture = tex
+        self.text_rect.size = tex.size
+        self.body.height = data['height'] - BUBBLE_CHROME
+        self._place_text()
+        return super().refresh_view_attrs(rv, index, data)
+    
+    def _place_text(self, *a):
+        self.text_rect.pos = (self.body.x, self.body.top - self.text_rect.size[1])
+    
     def _upd(self, *a):
         self.bg.pos = self.pos
         self.bg.size = self.size
     
-    def _resize(self, inst, sz):
-        inst.height = sz[1]
-        self.height = sz[1] + dp(44)
-    
     def on_touch_down(self, touch):
         if self.collide_point(*touch.pos):
             self._touch_start = Clock.get_time()
@@ -181,36 +207,202 @@ class MessageBubble(BoxLayout):
     
     def _long_press(self, dt):
         if self._touch_start:
+            from kivy.core.clipboard import Clipboard
             Clipboard.copy(self._text)
-            if PLYER:
-                try:
-                    vibrator.vibrate(0.05)
-                except:
-                    pass
+            try:
+                from plyer import vibrator
+                vibrator.vibrate(0.05)
+            except:
+                pass
+
+
+class ChatList(RecycleView):
+    """Лента сообщений: данные - список dict, виджеты есть только у видимых
+    
+    Высота каждого сообщения считается один раз на ширину текста и
+    хранится в данных, чтобы RecycleView не мерил невидимые виджеты.
+    Замеры и текстуры - в LayoutCache.
+    """
+    
+    # Сколько строк перемеривать за одно обновление после смены ширины
+    REMEASURE_CHUNK = 50
+    
+    def __init__(self, **kwargs):
+        super().__init__(do_scroll_x=False, bar_width=dp(3), bar_color=RED, **kwargs)
+        layout = RecycleBoxLayout(
+            orientation='vertical', size_hint_y=None, default_size_hint=(1, None),
+            spacing=dp(10), padding=[dp(10), dp(10)]
+        )
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+        # viewclass уходит в layout manager - задаётся после add_widget
+        self.viewclass = MessageBubble
+        self.layout_cache = LayoutCache(color=TEXT_WHITE)
+        self.precompute = Precomputer(self.layout_cache)
+        self.restoring = False
+        Window.bind(width=self._on_width)
+    
+    @staticmethod
+    def text_width():
+        return int(Window.width - dp(70))
+    
+    def measure(self, text, width, slot=None):
+        return self.layout_cache.height(text, width, FONT_SIZE, slot) + BUBBLE_CHROME
+    
+    def item(self, text, is_claude, time, height=None, slot=None):
+        width = self.text_width()
+        return {
+            'text': text, 'is_claude': is_claude, 'time': time, 'text_width': width,
+            'height': self.measure(text, width, slot) if height is None else height,
+            'slot': slot,
+        }
+    
+    @staticmethod
+    def _fields(m):
+        return m['content'], m['role'] == 'assistant', _time_label(m.get('timestamp'))
+    
+    def append(self, text, is_claude=False, ts=None):
+        """Добавить сообщение, вернуть его номер"""
+        self.data.append(self.item(text, is_claude, _time_label(ts)))
+        return len(self.data) - 1
+    
+    def extend(self, messages):
+        """Сообщения журнала (dict role/content/timestamp) в конец - одним обновлением"""
+        self.data.extend(self.item(*self._fields(m)) for m in messages)
+    
+    def prepend(self, messages, on_done=None):
+        """Более старые сообщения в начало, не сдвигая то, что на экране.
+        
+        Высоты меряются между кадрами; потом строки вставляются разом и
+        вызывается on_done(число строк).
+        """
+        fields = [self._fields(m) for m in messages]
+        if not fields:
+            if on_done:
+                on_done(0)
+            return
+        # Пока позиция не восстановлена, scroll_y ещё старый - не реагировать на него
+        self.restoring = True
+        width = self.text_width()
+        
+        def measured(heights):
+            items = [self.item(*f, height=h + BUBBLE_CHROME) for f, h in zip(fields, heights)]
+            self._insert_top(items)
+            if on_done:
+                on_done(len(items))
+        
+        self.precompute.measure([f[0] for f in fields], width, FONT_SIZE, measured)
+    
+    def _insert_top(self, items):
+        layout = self.children[0]
+        above = (1 - self.scroll_y) * max(0, layout.height - self.height)
+        added = sum(d['height'] for d in items) + layout.spacing * len(items)
+        
+        def restore(*a):
+            # Новая высота известна только после раскладки - держим прежний отступ сверху
+            layout.unbind(height=restore)
+            scrollable = layout.height - self.height
+            if scrollable > 0:
+                self.scroll_y = max(0, min(1, 1 - (above + added) / scrollable))
+            self.restoring = False
+        
+        layout.bind(height=restore)
+        self.data = items + list(self.data)
+    
+    def set_text(self, index, text, slot=None):
+        """slot - текст ещё меняется (стрим): не кэшировать каждую версию"""
+        with instrumentation.timer("set_text"):
+            d = self.data[index]
+            # Одна раскладка: текстура сразу даёт и высоту, и картинку для вида
+            self.layout_cache.texture(text, self.text_width(), FONT_SIZE, slot)
+            self.data[index] = self.item(text, d['is_claude'], d['time'], slot=slot)
+            if slot is None and d.get('slot') is not None:
+                self.layout_cache.release(d['slot'])
+    
+    def get_text(self, index):
+        return self.data[index]['text']
+    
+    def clear(self):
+        self.precompute.cancel()
+        self.layout_cache.release()
+        self.restoring = False
+        self.data = []
+    
+    @property
+    def at_bottom(self):
+        return self.scroll_y <= 0.01 or self.children[0].height <= self.height
+    
+    def scroll_down(self):
+        # Высота layout обновится только в следующем кадре
+        Clock.schedule_once(self._scroll_bottom, 0)
+    
+    def _scroll_bottom(self, dt):
+        with instrumentation.timer("scroll_down"):
+            self.scroll_y = 0
+    
+    def _on_width(self, *a):
+        """Поворот: известные высоты - из кэша, остальные сначала примерно,
+        потом точно порциями между кадрами, начиная с нижних (видимых)"""
+        width = self.text_width()
+        if not self.data or self.data[-1]['text_width'] == width:
+            return
+        cache = self.layout_cache
+        items, pending = [], []
+        for d in self.data:
+            h = cache.cached_height(d['text'], width, FONT_SIZE)
+            item = dict(d, text_width=width)
+            if h is None:
+                h = cache.estimate(d['text'], width, FONT_SIZE)
+                pending.append(item)
+            item['height'] = h + BUBBLE_CHROME
+            items.append(item)
+        self.data = items
+        
+        pending.reverse()
+        for i in range(0, len(pending), self.REMEASURE_CHUNK):
+            chunk = pending[i:i + self.REMEASURE_CHUNK]
+            self.precompute.measure([d['text'] for d in chunk], width, FONT_SIZE,
+                                    lambda heights, chunk=chunk: self._remeasured(chunk, heights))
+    
+    def _remeasured(self, chunk, heights):
+        changed = False
+        for d, h in zip(chunk, heights):
+            # Строку могли заменить (стрим) или ширина опять сменилась
+            if d['text_width'] == self.text_width() and d['height'] != h + BUBBLE_CHROME:
+                d['height'] = h + BUBBLE_CHROME
+                changed = True
+        if changed:
+            self.refresh_from_data()
 
 
 class ClaudeHome(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.memory = Memory(get_data_dir())
+        # Memory грузится в фоне после первого кадра, см. _load_backend
+        self.memory = None
         self.client = None
         self.pending_file = None
         self.pending_type = None
+        self._ingest = None         # фоновое чтение текстового файла, см. ingest
+        self._export_job = None
         self.loading = False
+        
+        # Потоковый ответ: поток запроса копит куски, UI забирает раз в STREAM_EVERY
+        self._stream_lock = threading.Lock()
+        self._stream_parts = []
+        self._stream_index = None
+        self._stream_event = None
+        self._stream_drawn = 0
+        
+        # Ранние сообщения подгружаются при прокрутке вверх, см. _on_scroll
+        self._first = 0             # номер в журнале первого показанного
+        self._loading_older = False
+        self._history_gen = 0       # меняется при очистке истории
     
     def build(self):
         self.title = "Claude Home"
         Window.clearcolor = BLACK
         
-        if ANDROID:
-            request_permissions([
-                Permission.INTERNET,
-                Permission.READ_EXTERNAL_STORAGE,
-                Permission.WRITE_EXTERNAL_STORAGE,
-                Permission.READ_MEDIA_IMAGES,
-                Permission.VIBRATE,
-            ])
-        
         try:
             get_shared_dir().mkdir(exist_ok=True)
         except:
@@ -240,10 +432,7 @@ class ClaudeHome(App):
         header.add_widget(menu)
         
         # Chat
-        self.scroll = ScrollView(do_scroll_x=False, bar_width=dp(3), bar_color=RED)
-        self.chat = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(10), padding=[dp(10), dp(10)])
-        self.chat.bind(minimum_height=self.chat.setter('height'))
-        self.scroll.add_widget(self.chat)
+        self.chat = ChatList()
         
         # Preview
         self.preview = BoxLayout(size_hint_y=None, height=0, padding=[dp(10), dp(5)])
@@ -288,7 +477,7 @@ class ClaudeHome(App):
         self.inp_area.add_widget(send)
         
         self.root_box.add_widget(header)
-        self.root_box.add_widget(self.scroll)
+        self.root_box.add_widget(self.chat)
         self.root_box.add_widget(self.preview)
         self.root_box.add_widget(self.inp_area)
         
@@ -297,11 +486,83 @@ class ClaudeHome(App):
         
         if not API_KEY:
             Clock.schedule_once(lambda dt: self.api_dialog(), 0.3)
-        else:
-            self.init()
         
+        # Сначала пустой интерфейс на экран, потом всё остальное
+        Clock.schedule_once(self._first_frame, 0)
+        startup.mark("build")
         return self.root_box
     
+    def _first_frame(self, dt):
+        startup.mark("first_frame")
+        if ANDROID:
+            request_permissions([
+                Permission.INTERNET,
+                Permission.READ_EXTERNAL_STORAGE,
+                Permission.WRITE_EXTERNAL_STORAGE,
+                Permission.READ_MEDIA_IMAGES,
+                Permission.VIBRATE,
+            ])
+        threading.Thread(target=self._load_backend, name="startup", daemon=True).start()
+    
+    def _load_backend(self):
+        """Фоновый поток: модули, Memory и последние сообщения"""
+        try:
+            import api_client, attachments, capability_cache, tools
+            from memory import Memory
+            startup.mark("backend_imports")
+            
+            attachments.get_cache(get_data_dir() / 'cache' / 'images')
+            capability_cache.get_cache(get_data_dir() / 'cache' / 'capabilities')
+            memory = Memory(get_data_dir())
+            startup.mark("memory")
+            
+            total = memory.count()
+            first = max(0, total - HISTORY_PAGE)
+            recent = memory.get_messages(first, total)
+        except Exception as e:
+            err = f"Ошибка: {e}"
+            Clock.schedule_once(lambda dt: self.add_bubble(err, True), 0)
+            return
+        Clock.schedule_once(lambda dt: self._backend_ready(memory, first, recent), 0)
+        # Просроченное с прошлых запусков - уже после показа истории
+        capability_cache.get_cache().prune()
+    
+    def _backend_ready(self, memory, first, recent):
+        self.memory = memory
+        memory.on_write_error = lambda path, e: Clock.schedule_once(
+            lambda dt: self._write_failed(path, e), 0)
+        self._first = first
+        # Короткая страница не прокручивается - тогда догружаем, пока не заполнит экран
+        self.chat.children[0].bind(height=self._fill_view)
+        self.chat.bind(height=self._fill_view)
+        self.chat.extend(recent)
+        self.chat.bind(scroll_y=self._on_scroll)
+        self.scroll_down()
+        if API_KEY:
+            self.init()
+        if load_config().get('metrics') or os.environ.get('CLAUDE_METRICS'):
+            instrumentation.get_metrics().start(get_data_dir())
+        startup.mark("history")
+        # Отчёт - после кадра с историей
+        Clock.schedule_once(lambda dt: startup.report(get_data_dir()), 0)
+    
+    def _write_failed(self, path, error):
+        # Диск полон и т.п. - каждое сообщение будет падать, не заваливаем чат
+        text = f"Не удалось сохранить {path.name if path else 'данные'}: {error}"
+        if text != getattr(self, '_last_write_error', None):
+            self._last_write_error = text
+            self.add_bubble(text, True)
+    
+    def on_pause(self):
+        # Android может убить приложение в фоне - дописываем всё на диск
+        if self.memory:
+            self.memory.flush()
+        return True
+    
+    def on_stop(self):
+        if self.memory:
+            self.memory.flush()
+    
     def _on_keyboard(self, window, key, *args):
         # Back button на Android
         if key == 27:
@@ -323,6 +584,7 @@ class ClaudeHome(App):
         btn.bind(on_press=self._save_key)
         box.add_widget(btn)
         
+        from kivy.uix.popup import Popup
         self.api_pop = Popup(title="", content=box, size_hint=(0.9, 0.4), auto_dismiss=False, separator_height=0)
         self.api_pop.open()
     
@@ -334,21 +596,57 @@ class ClaudeHome(App):
             self.init()
     
     def init(self):
+        from api_client import Anthropic
         self.client = Anthropic(api_key=API_KEY)
-        for m in self.memory.get_recent_messages(50):
-            self.add_bubble(m['content'], m['role'] == 'assistant', m.get('timestamp'))
-        Clock.schedule_once(lambda dt: self.scroll_down(), 0.1)
+    
+    def _on_scroll(self, chat, scroll_y):
+        if scroll_y < 0.9 or chat.restoring:
+            return
+        self._load_more()
+    
+    def _fill_view(self, *a):
+        if self.chat.children[0].height <= self.chat.height:
+            self._load_more()
+    
+    def _load_more(self):
+        if self._first == 0 or self._loading_older or self.memory is None:
+            return
+        self._loading_older = True
+        threading.Thread(target=self._load_older, args=(self._first, self._history_gen), daemon=True).start()
+    
+    def _load_older(self, stop, gen):
+        start = max(0, stop - HISTORY_PAGE)
+        try:
+            msgs = self.memory.get_messages(start, stop)
+        except Exception:
+            msgs = []
+        Clock.schedule_once(lambda dt: self._prepend(start, msgs, gen), 0)
+    
+    def _prepend(self, start, msgs, gen):
+        if gen != self._history_gen:
+            self._loading_older = False
+            return
+        self.chat.prepend(msgs, on_done=lambda n: self._prepended(start, n, gen))
+    
+    def _prepended(self, start, n, gen):
+        self._loading_older = False
+        if gen != self._history_gen:
+            return
+        self._first = start
+        if self._stream_index is not None:
+            self._stream_index += n
     
     def add_bubble(self, text, is_claude=False, ts=None):
-        b = MessageBubble(text, is_claude, ts)
-        self.chat.add_widget(b)
-        return b
+        with instrumentation.timer("add_bubble"):
+            return self.chat.append(text, is_claude, ts)
     
     def scroll_down(self):
-        self.scroll.scroll_y = 0
+        self.chat.scroll_down()
     
     def pick_file(self, *a):
-        if not PLYER:
+        try:
+            from plyer import filechooser
+        except:
             return
         try:
             filechooser.open_file(on_selection=self._file_selected)
@@ -365,19 +663,27 @@ class ClaudeHome(App):
         name = os.path.basename(path)
         
         if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp']:
+            # Недочитанный текстовый файл не должен потом подменить картинку
+            self._cancel_file()
             self.pending_file = path
             self.pending_type = 'image'
             self._show_preview(path, name, "📷")
+            # Пережимаем в фоне, пока пользователь печатает
+            import attachments
+            attachments.prefetch(path)
         
         elif ext in ['py', 'js', 'ts', 'java', 'c', 'cpp', 'h', 'cs', 'go', 'rs', 'rb', 'php', 'swift', 'kt', 'sh', 'sql', 'html', 'css', 'xml', 'json', 'yaml', 'yml', 'toml', 'md', 'txt', 'log', 'csv', 'ini', 'cfg', 'conf']:
-            try:
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                self.pending_file = {'name': name, 'content': content, 'ext': ext}
-                self.pending_type = 'code'
-                self._show_preview(None, name, "📄")
-            except Exception as e:
-                self.add_bubble(f"Ошибка: {e}", True)
+            # Читаем в фоне кусками; большой файл превратится в выдержку
+            import ingest
+            self._cancel_file()
+            self.pending_type = 'code'
+            self._show_preview(None, name, "📄")
+            self.preview_label.text = f"📄 {name[:25]}  0%"
+            job = self._ingest = ingest.IngestJob(
+                path,
+                on_progress=lambda p: Clock.schedule_once(lambda dt: self._ingest_progress(job, name, p), 0),
+                on_done=lambda r: Clock.schedule_once(lambda dt: self._ingested(job, r), 0),
+                on_error=lambda e: Clock.schedule_once(lambda dt: self._ingest_failed(job, name, e), 0))
         else:
             self.add_bubble(f"Тип .{ext} не поддерживается", True)
     
@@ -392,15 +698,37 @@ class ClaudeHome(App):
                          size=lambda *a: setattr(self.prev_bg, 'size', self.preview.size))
         
         if img_path:
+            from kivy.uix.image import Image as KivyImage
             self.preview.add_widget(KivyImage(source=img_path, size_hint_x=None, width=dp(45)))
         
-        self.preview.add_widget(Label(text=f"{icon} {name[:25]}", color=TEXT_WHITE, font_size=dp(13)))
+        self.preview_label = Label(text=f"{icon} {name[:25]}", color=TEXT_WHITE, font_size=dp(13))
+        self.preview.add_widget(self.preview_label)
         
         cancel = Button(text="✕", size_hint_x=None, width=dp(40), background_color=[0.4,0.1,0.1,1], color=TEXT_WHITE)
         cancel.bind(on_press=self._cancel_file)
         self.preview.add_widget(cancel)
     
+    def _ingest_progress(self, job, name, fraction):
+        if job is self._ingest:
+            self.preview_label.text = f"📄 {name[:25]}  {int(fraction * 100)}%"
+    
+    def _ingested(self, job, result):
+        if job is not self._ingest:
+            return
+        self._ingest = None
+        self.pending_file = result
+        self.preview_label.text = f"📄 {result['name'][:25]}" + ("  (выдержка)" if result['excerpt'] else "")
+    
+    def _ingest_failed(self, job, name, error):
+        if job is not self._ingest:
+            return
+        self._cancel_file()
+        self.add_bubble(f"Ошибка: {name}: {error}", True)
+    
     def _cancel_file(self, *a):
+        if self._ingest:
+            self._ingest.cancel()
+            self._ingest = None
         self.pending_file = None
         self.pending_type = None
         self.preview.clear_widgets()
@@ -411,20 +739,27 @@ class ClaudeHome(App):
         
         if not text and not self.pending_file:
             return
-        if self.loading:
+        if self.loading or self.memory is None or self._ingest:
             return
+        # Задержки: до кадра с пузырём и до кадра с первым токеном ответа
+        metrics = instrumentation.get_metrics()
+        metrics.tap("send")
         
         display = ""
+        attachment = None
         if self.pending_type == 'image':
+            attachment = self.pending_file
             name = os.path.basename(self.pending_file)
             display = f"[📷 {name}]" + (f"\n{text}" if text else "")
         elif self.pending_type == 'code':
+            attachment = self.pending_file['path']
             display = f"[📄 {self.pending_file['name']}]" + (f"\n{text}" if text else "")
         else:
             display = text
         
         self.add_bubble(display, False)
-        self.memory.add_message('user', display)
+        metrics.rendered("send")
+        self.memory.add_message('user', display, attachment)
         self.scroll_down()
         
         msg_text = text
@@ -438,29 +773,34 @@ class ClaudeHome(App):
         self.preview.height = 0
         
         self.loading = True
+        with self._stream_lock:
+            self._stream_parts = []
         threading.Thread(target=self._request, args=(msg_text, file_data, file_type), daemon=True).start()
     
     def _request(self, text, file_data, file_type):
+        import attachments, tools   # уже загружены в _load_backend
         try:
-            messages = self.memory.get_context_for_api(30)
-            system = SYSTEM_PROMPT + "\n\n" + SELF_KNOWLEDGE + "\n\n" + self.memory.get_memory_summary()
+            # Неизменная часть system и начало истории уходят в кэш, см. request_builder
+            start, history, summary = self.memory.context.build()
+            stable = SYSTEM_PROMPT + "\n\n" + SELF_KNOWLEDGE + "\n\n" + self.memory.get_identity_summary()
+            # Недавние сообщения уже есть в окне истории - в system их не дублируем
+            volatile = self._relevant_memories(text)
             
             content = []
             
             if file_type == 'image' and file_data:
                 try:
-                    with open(file_data, 'rb') as f:
-                        img_b64 = base64.b64encode(f.read()).decode()
-                    ext = file_data.lower().split('.')[-1]
-                    mtype = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp', 'bmp': 'image/bmp'}.get(ext, 'image/jpeg')
-                    content.append({"type": "image", "source": {"type": "base64", "media_type": mtype, "data": img_b64}})
+                    # Уменьшенная копия без EXIF, обычно уже готова (см. _process_file)
+                    content.append(attachments.image_block(file_data))
                 except Exception as e:
-                    Clock.schedule_once(lambda dt: self.add_bubble(f"Ошибка: {e}", True), 0)
+                    err = f"Ошибка: {e}"
+                    Clock.schedule_once(lambda dt: self.add_bubble(err, True), 0)
                     self.loading = False
                     return
             
             if file_type == 'code' and file_data:
-                file_text = f"=== {file_data['name']} ===\n```{file_data['ext']}\n{file_data['content']}\n```"
+                title = file_data['name'] + (f" ({file_data['note']})" if file_data.get('excerpt') else "")
+                file_text = f"=== {title} ===\n```{file_data['ext']}\n{file_data['content']}\n```"
                 if text:
                     content.append({"type": "text", "text": f"{file_text}\n\n{text}"})
                 else:
@@ -472,33 +812,100 @@ class ClaudeHome(App):
                 self.loading = False
                 return
             
-            if messages and messages[-1]["role"] == "user":
-                messages[-1] = {"role": "user", "content": content}
-            else:
-                messages.append({"role": "user", "content": content})
-            
-            response = self.client.messages.create(
-                model=MODEL, max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE, system=system, messages=messages
+            payload = request_builder.build(
+                MODEL, MAX_TOKENS, stable, volatile, history, content,
+                start=start, summary=summary, temperature=TEMPERATURE
             )
             
-            reply = response.content[0].text
-            self.memory.add_message('assistant', reply)
+            # Ответ печатается по мере генерации, см. _flush_stream
+            Clock.schedule_once(lambda dt: self._start_stream(), 0)
+            # Инструменты (поиск, погода, ...) выполняются параллельно, см. tools
+            reply = tools.stream_with_tools(
+                self.client, payload,
+                on_text=self._stream_piece,
+                on_message=lambda m: request_builder.stats.record(m.usage)
+            )
+            if reply:
+                self.memory.add_message('assistant', reply)
             
-            Clock.schedule_once(lambda dt: self._show_reply(reply), 0)
+            Clock.schedule_once(lambda dt: self._end_stream(reply), 0)
             
         except Exception as e:
-            Clock.schedule_once(lambda dt: self._show_reply(f"Ошибка: {e}"), 0)
+            with self._stream_lock:
+                partial = "".join(self._stream_parts)
+            err = f"{partial}\n\nОшибка: {e}" if partial else f"Ошибка: {e}"
+            Clock.schedule_once(lambda dt: self._end_stream(err), 0)
         finally:
             self.loading = False
     
-    def _show_reply(self, text):
-        self.add_bubble(text, True)
+    def _stream_piece(self, piece):
+        with self._stream_lock:
+            self._stream_parts.append(piece)
+    
+    def _start_stream(self):
+        self._stream_index = self.add_bubble("…", True)
+        self._stream_event = Clock.schedule_interval(self._flush_stream, 0)
         self.scroll_down()
     
+    def _flush_stream(self, dt):
+        # Первый кусок - в ближайший кадр, дальше не чаще STREAM_EVERY:
+        # иначе на длинном ответе работа растёт квадратично
+        i = self._stream_index
+        if i is None:
+            return
+        first = self.chat.get_text(i) == "…"
+        now = Clock.get_boottime()
+        if not first and now - self._stream_drawn < STREAM_EVERY:
+            return
+        with self._stream_lock:
+            text = "".join(self._stream_parts)
+        if text and text != self.chat.get_text(i):
+            if first:
+                instrumentation.get_metrics().rendered("first_token", since="send")
+            at_bottom = self.chat.at_bottom
+            self.chat.set_text(i, text, slot="stream")
+            self._stream_drawn = now
+            if at_bottom:
+                self.scroll_down()
+    
+    def _end_stream(self, text):
+        if self._stream_event:
+            self._stream_event.cancel()
+            self._stream_event = None
+        if self._stream_index is None:
+            self._show_reply(text)
+        else:
+            self.chat.set_text(self._stream_index, text)
+            self._stream_index = None
+            self.scroll_down()
+    
+    def _relevant_memories(self, text):
+        """Записи долгой памяти по словам сообщения"""
+        if not text:
+            return ""
+        try:
+            found = memory_store.query(text.split(), 3)
+        except Exception:
+            return ""
+        if not found:
+            return ""
+        return "\n\nRELEVANT MEMORIES:\n" + "\n".join(
+            f"- {m['topic']}: {m['summary']}" for m in found)
+    
+    def _show_reply(self, text):
+        with instrumentation.timer("show_reply"):
+            self.add_bubble(text, True)
+            self.scroll_down()
+    
     def show_menu(self, *a):
+        if self.memory is None:
+            return
+        from kivy.uix.popup import Popup
         box = BoxLayout(orientation='vertical', padding=dp(15), spacing=dp(12))
-        box.add_widget(Label(text=f"Сообщений: {len(self.memory.chat_history)}", color=TEXT_WHITE, size_hint_y=None, height=dp(30)))
+        box.add_widget(Label(text=f"Сообщений: {self.memory.count()}", color=TEXT_WHITE, size_hint_y=None, height=dp(30)))
+        cache = request_builder.stats
+        if cache.requests:
+            box.add_widget(Label(text=f"Кэш: {cache.hit_ratio:.0%} входа, {cache.hits}/{cache.requests} запросов", color=TEXT_GRAY, size_hint_y=None, height=dp(24)))
         
         bkp = Button(text="💾 Backup", size_hint_y=None, height=dp(48), background_color=RED, color=TEXT_WHITE)
         bkp.bind(on_press=lambda x: self._backup())
@@ -508,37 +915,85 @@ class ClaudeHome(App):
         exp.bind(on_press=lambda x: self._export())
         box.add_widget(exp)
         
+        metrics = instrumentation.get_metrics()
+        met = Button(text="📈 Metrics: " + ("on" if metrics.enabled else "off"), size_hint_y=None, height=dp(48), background_color=DARK2, color=TEXT_WHITE)
+        met.bind(on_press=lambda x: self._toggle_metrics())
+        box.add_widget(met)
+        
         clr = Button(text="🗑 Clear", size_hint_y=None, height=dp(48), background_color=[0.35,0.1,0.1,1], color=TEXT_WHITE)
         clr.bind(on_press=lambda x: self._clear())
         box.add_widget(clr)
         
-        self.menu_pop = Popup(title="", content=box, size_hint=(0.85, 0.45), title_color=TEXT_WHITE, separator_height=0)
+        self.menu_pop = Popup(title="", content=box, size_hint=(0.85, 0.52), title_color=TEXT_WHITE, separator_height=0)
         self.menu_pop.open()
     
+    def _toggle_metrics(self):
+        self.menu_pop.dismiss()
+        on = instrumentation.get_metrics().toggle(get_data_dir())
+        if on:
+            self.add_bubble(f"Метрики пишутся в {get_data_dir() / instrumentation.FILE}", True)
+    
     def _backup(self):
         self.memory.create_backup()
         self.menu_pop.dismiss()
         self.add_bubble("Backup ✓", True)
     
     def _export(self):
-        try:
-            d = get_shared_dir()
-            d.mkdir(exist_ok=True)
-            f = d / f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-            with open(f, 'w', encoding='utf-8') as file:
-                for m in self.memory.chat_history:
-                    role = "Claude" if m['role'] == 'assistant' else "Lien"
-                    file.write(f"[{m.get('timestamp', '')[:16]}] {role}: {m['content']}\n\n")
-            self.menu_pop.dismiss()
-            self.add_bubble(f"Экспорт: {f}", True)
-        except Exception as e:
-            self.add_bubble(f"Ошибка: {e}", True)
+        """Выбор формата; сам экспорт идёт в фоне, см. exporter"""
+        import exporter
+        from kivy.uix.popup import Popup
+        self.menu_pop.dismiss()
+        if self._export_job:
+            self.export_pop.open()
+            return
+        box = BoxLayout(orientation='vertical', padding=dp(15), spacing=dp(12))
+        for fmt, title in exporter.FORMATS.items():
+            btn = Button(text=title, size_hint_y=None, height=dp(48), background_color=DARK2, color=TEXT_WHITE)
+            btn.bind(on_press=lambda x, fmt=fmt: self._start_export(fmt))
+            box.add_widget(btn)
+        self.export_pop = Popup(title="📤 Export", content=box, size_hint=(0.85, 0.5), title_color=TEXT_WHITE, separator_height=0)
+        self.export_pop.open()
+    
+    def _start_export(self, fmt):
+        import exporter
+        box = self.export_pop.content
+        box.clear_widgets()
+        self.export_label = Label(text="0%", color=TEXT_WHITE)
+        box.add_widget(self.export_label)
+        cancel = Button(text="Отмена", size_hint_y=None, height=dp(48), background_color=[0.35,0.1,0.1,1], color=TEXT_WHITE)
+        cancel.bind(on_press=lambda x: self._cancel_export())
+        box.add_widget(cancel)
+        job = self._export_job = exporter.ExportJob(
+            self.memory, get_shared_dir(), fmt,
+            on_progress=lambda p: Clock.schedule_once(lambda dt: self._export_progress(job, p), 0),
+            on_done=lambda path: Clock.schedule_once(lambda dt: self._exported(job, f"Экспорт: {path}"), 0),
+            on_error=lambda e: Clock.schedule_once(lambda dt: self._exported(job, f"Ошибка: {e}"), 0))
+    
+    def _export_progress(self, job, fraction):
+        if job is self._export_job:
+            self.export_label.text = f"{int(fraction * 100)}%"
+    
+    def _exported(self, job, text):
+        if job is not self._export_job:
+            return
+        self._export_job = None
+        self.export_pop.dismiss()
+        self.add_bubble(text, True)
+    
+    def _cancel_export(self):
+        if self._export_job:
+            self._export_job.cancel()
+            self._export_job = None
+        self.export_pop.dismiss()
     
     def _clear(self):
         self.memory.create_backup()
-        self.memory.chat_history = []
-        self.memory._save(self.memory.chat_file, [])
-        self.chat.clear_widgets()
+        self.memory.clear_history()
+        self.chat.clear()
+        self._stream_index = None
+        self._first = 0
+        self._history_gen += 1
+        self._loading_older = False
         self.menu_pop.dismiss()
 
 
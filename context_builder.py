@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Контекст для API по бюджету токенов
+
+Вместо фиксированных 30 сообщений берём столько свежих, сколько влезает
+в BUDGET токенов (оценка локальная, без запросов к API). То, что не
+влезло, сворачивается в короткую сводку "раньше в разговоре". Начало
+окна выравнивается по STEP сообщений, чтобы префикс запроса не менялся
+каждый ход и попадал в кэш (см. request_builder).
+"""
+
+import threading
+
+from request_builder import STEP
+
+BUDGET = 24000          # токенов на историю
+SUMMARY_BUDGET = 1500   # токенов на сводку того, что не влезло
+SUMMARY_LINE = 160      # символов от сообщения в сводке
+PAGE = 50               # сообщений за одно чтение журнала
+
+MESSAGE_OVERHEAD = 4    # роль и разметка сообщения
+IMAGE_TOKENS = 1600     # картинка ~1568px по длинной стороне
+
+
+def estimate_tokens(text):
+    """Грубая оценка: латиница ~4 символа на токен, кириллица и прочее ~2"""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars) // 2 + 1
+
+
+def content_tokens(content):
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    tokens = 0
+    for block in content:
+        if block.get("type") == "image":
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += estimate_tokens(block.get("text", ""))
+    return tokens
+
+
+def _blocks(content):
+    return [{"type": "text", "text": content}] if isinstance(content, str) else list(content)
+
+
+def alternate(messages):
+    """Первым user, роли чередуются, подряд идущие от одного - склеиваются"""
+    final = []
+    for msg in messages:
+        if not final and msg["role"] == "assistant":
+            continue
+        if final and final[-1]["role"] == msg["role"]:
+            prev = final[-1]["content"]
+            if isinstance(prev, str) and isinstance(msg["content"], str):
+                final[-1]["content"] = prev + "\n" + msg["content"]
+            else:
+                final[-1]["content"] = _blocks(prev) + _blocks(msg["content"])
+        else:
+            final.append({"role": msg["role"], "content": msg["content"]})
+    return final
+
+
+class ContextBuilder:
+    # Сколько оценок держать в памяти
+    MAX_CACHED = 5000
+
+    def __init__(self, memory, budget=BUDGET, summary_budget=SUMMARY_BUDGET, step=STEP):
+        self.memory = memory
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.step = step
+        self.lock = threading.Lock()
+        self._counts = {}       # (timestamp, role, длина) -> токены
+        self._summary_key = None
+        self._summary = ""
+
+    def tokens(self, msg):
+        """Оценка для сообщения журнала (запоминается)"""
+        content = msg.get("content", "")
+        key = (msg.get("timestamp"), msg.get("role"), len(content))
+        n = self._counts.get(key)
+        if n is None:
+            n = content_tokens(content) + MESSAGE_OVERHEAD
+            if len(self._counts) >= self.MAX_CACHED:
+                self._counts.clear()
+            self._counts[key] = n
+        return n
+
+    def _pack(self, total):
+        """Самое раннее начало, при котором хвост влезает в бюджет.
+
+        Возвращает (start, сообщения start..total-1).
+        """
+        window = []
+        used = 0
+        hi = total
+        while hi > 0:
+            lo = max(0, hi - PAGE)
+            page = self.memory.get_messages(lo, hi)
+            for msg in reversed(page):
+                n = self.tokens(msg)
+                # Последнее сообщение берём всегда, даже если оно одно больше бюджета
+                if window and used + n > self.budget:
+                    window.reverse()
+                    return total - len(window), window
+                used += n
+                window.append(msg)
+            hi = lo
+        window.reverse()
+        return 0, window
+
+    def build(self, n=None):
+        """(start, messages, summary) для текущей истории
+
+        start - номер первого сообщения окна в журнале,
+        messages - окно для API, summary - сводка того, что раньше окна.
+        n - не больше стольких последних сообщений (кроме бюджета).
+        """
+        with self.lock:
+            total = self.memory.count()
+            start, window = self._pack(total)
+            if n is not None and len(window) > n:
+                window = window[len(window) - n:] if n > 0 else []
+                start = total - len(window)
+
+            # Выравниваем вперёд: окно чуть меньше, зато одинаковое STEP ходов
+            aligned = -(-start // self.step) * self.step
+            if aligned < total - 1:
+                window = window[aligned - start:]
+                start = aligned
+
+            messages = alternate({"role": m["role"], "content": m["content"]} for m in window)
+            return start, messages, self._overflow(start)
+
+    def _overflow(self, start):
+        """Сводка сообщений до start (кэшируется, пока start не сдвинулся)"""
+        if start == 0:
+            return ""
+        if start == self._summary_key:
+            return self._summary
+
+        lines = []
+        used = 0
+        hi = start
+        while hi > 0 and used < self.summary_budget:
+            lo = max(0, hi - PAGE)
+            for msg in reversed(self.memory.get_messages(lo, hi)):
+                text = msg.get("content", "")
+                if not isinstance(text, str):
+                    text = " ".join(b.get("text", "") for b in text)
+                text = " ".join(text.split())
+                if len(text) > SUMMARY_LINE:
+                    text = text[:SUMMARY_LINE] + "..."
+                line = f"[{msg.get('timestamp', '')[:16]}] [{msg['role']}] {text}"
+                used += estimate_tokens(line)
+                if used > self.summary_budget:
+                    break
+                lines.append(line)
+            hi = lo
+        lines.reverse()
+
+        self._summary = (
+            f"\n=== EARLIER IN THIS CONVERSATION ({start} messages before, newest {len(lines)}) ===\n"
+            + "\n".join(lines) + "\n"
+        )
+        self._summary_key = start
+        return self._summary
+
+    def clear(self):
+        with self.lock:
+            self._counts.clear()
+            self._summary_key = None
+            self._summary = ""
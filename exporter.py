@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Экспорт истории чата в фоне
+
+Форматы (FORMATS): txt, md, jsonl и zip - chat.md + messages.jsonl и
+прикреплённые файлы, которые ещё лежат на месте, в attachments/.
+История читается из журнала страницами по PAGE сообщений и сразу
+пишется в файл, целиком в памяти не бывает. Пишется во временный
+*.part, готовый файл появляется только после успешного конца.
+"""
+
+import json
+import os
+import threading
+import zipfile
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+PAGE = 500
+
+FORMATS = {
+    "txt": "Текст",
+    "md": "Markdown",
+    "jsonl": "JSONL",
+    "zip": "ZIP с файлами",
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _author(msg):
+    return "Claude" if msg["role"] == "assistant" else "Lien"
+
+
+def format_txt(msg, attachment=None):
+    return f"[{msg.get('timestamp', '')[:16]}] {_author(msg)}: {msg['content']}\n\n"
+
+
+def format_md(msg, attachment=None):
+    when = msg.get("timestamp", "")[:16].replace("T", " ")
+    text = f"**{_author(msg)}** · {when}\n\n{msg['content']}\n"
+    if attachment:
+        text += f"\n📎 [{os.path.basename(attachment)}]({attachment})\n"
+    return text + "\n---\n\n"
+
+
+def format_jsonl(msg, attachment=None):
+    if attachment:
+        msg = dict(msg, attachment=attachment)
+    return json.dumps(msg, ensure_ascii=False) + "\n"
+
+
+WRITERS = {"txt": format_txt, "md": format_md, "jsonl": format_jsonl}
+
+
+class Exporter:
+    def __init__(self, memory, dest_dir, fmt, progress=None, cancelled=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+        self.memory = memory
+        self.dest_dir = Path(dest_dir)
+        self.fmt = fmt
+        self.progress = progress
+        self.cancelled = cancelled
+        self.total = memory.count()     # что дописано во время экспорта - не берём
+        self._last_report = -1
+
+    def _messages(self):
+        return enumerate(islice(self.memory.iter_messages(PAGE), self.total))
+
+    def _step(self, done, total):
+        if self.cancelled and self.cancelled():
+            raise ExportCancelled()
+        if self.progress and total:
+            pct = int(done * 100 / total)
+            if pct > self._last_report:
+                self._last_report = pct
+                self.progress(done / total)
+
+    def run(self):
+        """Путь к готовому файлу"""
+        self.dest_dir.mkdir(parents=True, exist_ok=True)
+        path = self.dest_dir / f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{self.fmt}"
+        part = path.with_name(path.name + ".part")
+        try:
+            if self.fmt == "zip":
+                self._write_zip(part)
+            else:
+                self._write_text(part, WRITERS[self.fmt])
+            os.replace(part, path)
+        except BaseException:
+            try:
+                part.unlink()
+            except OSError:
+                pass
+            raise
+        return path
+
+    def _write_text(self, part, writer):
+        with open(part, "w", encoding="utf-8") as f:
+            for i, msg in self._messages():
+                if i % 50 == 0:
+                    self._step(i, self.total)
+                f.write(writer(msg, msg.get("attachment")))
+        self._step(self.total, self.total)
+
+    def _write_zip(self, part):
+        # Проходы: messages.jsonl (и список файлов), chat.md, сами файлы.
+        # zipfile пишет только один член архива за раз
+        work = 2 * self.total + 1
+        files = {}      # номер сообщения -> (путь, имя в архиве)
+        with zipfile.ZipFile(part, "w", zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("messages.jsonl", "w") as raw:
+                for i, msg in self._messages():
+                    if i % 50 == 0:
+                        self._step(i, work)
+                    src = msg.get("attachment")
+                    name = None
+                    if src and os.path.isfile(src):
+                        name = f"attachments/{i:06d}_{os.path.basename(src)}"
+                        files[i] = (src, name)
+                    raw.write(format_jsonl(msg, name).encode("utf-8"))
+            with zf.open("chat.md", "w") as raw:
+                for i, msg in self._messages():
+                    if i % 50 == 0:
+                        self._step(self.total + i, work)
+                    raw.write(format_md(msg, files.get(i, (None, None))[1]).encode("utf-8"))
+            done = 2 * self.total
+            for n, (src, name) in enumerate(files.values()):
+                self._step(done + n / len(files), work)
+                try:
+                    zf.write(src, name)
+                except OSError:
+                    pass        # файл удалили между проходами
+        self._step(work, work)
+
+
+def export(memory, dest_dir, fmt, progress=None, cancelled=None):
+    return Exporter(memory, dest_dir, fmt, progress, cancelled).run()
+
+
+class ExportJob:
+    """export() в фоновом потоке; колбэки зовутся из этого потока"""
+
+    def __init__(self, memory, dest_dir, fmt, on_progress=None, on_done=None, on_error=None):
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, args=(memory, dest_dir, fmt),
+                                       name="export", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _progress(self, fraction):
+        if self.on_progress and not self.cancelled:
+            self.on_progress(fraction)
+
+    def _run(self, memory, dest_dir, fmt):
+        try:
+            path = export(memory, dest_dir, fmt, self._progress, lambda: self.cancelled)
+        except ExportCancelled:
+            return
+        except Exception as e:
+            if self.on_error and not self.cancelled:
+                self.on_error(e)
+            return
+        if self.on_done and not self.cancelled:
+            self.on_done(path)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Полнотекстовый индекс истории на SQLite FTS5
+
+id сообщения = его порядковый номер в журнале (chat_history.jsonl).
+В messages_fts уходит текст после inverted_index.normalize (ё -> е и
+т.п.), запрос нормализуется так же - оба бэкенда находят одно и то же.
+"""
+
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from inverted_index import normalize
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    role TEXT,
+    ts TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_ts ON messages(ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 0'
+);
+"""
+
+OPERATORS = ("OR", "AND", "NOT")
+
+# PRAGMA user_version: 1 - текст в messages_fts нормализован
+VERSION = 1
+
+
+def fts5_available():
+    try:
+        con = sqlite3.connect(':memory:')
+        con.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        con.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def build_match(query):
+    """Запрос пользователя -> безопасное выражение FTS5
+
+    "фраза целиком" - фраза, слово* - префикс, OR/AND/NOT - операторы,
+    остальные слова через неявный AND.
+    """
+    parts = []
+    i, n = 0, len(query)
+    while i < n:
+        c = query[i]
+        if c.isspace():
+            i += 1
+        elif c == '"':
+            end = query.find('"', i + 1)
+            if end == -1:
+                end = n
+            phrase = query[i + 1:end].strip()
+            if phrase:
+                parts.append('"%s"' % normalize(phrase).replace('"', ''))
+            i = end + 1
+        else:
+            end = i
+            while end < n and not query[end].isspace() and query[end] != '"':
+                end += 1
+            word = query[i:end]
+            i = end
+            if word in OPERATORS:
+                if parts and parts[-1] not in OPERATORS:
+                    parts.append(word)
+                continue
+            prefix = word.endswith('*')
+            word = word.rstrip('*')
+            if word:
+                parts.append('"%s"%s' % (normalize(word), '*' if prefix else ''))
+    while parts and parts[-1] in OPERATORS:
+        parts.pop()
+    return " ".join(parts)
+
+
+def _ts(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class FtsIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(SCHEMA)
+        if self.con.execute("PRAGMA user_version").fetchone()[0] < VERSION:
+            self._reindex()
+
+    def _reindex(self):
+        """Индекс от старой версии - заново из messages, нормализованным"""
+        with self.lock, self.con:
+            self.con.execute("INSERT INTO messages_fts(messages_fts) VALUES ('delete-all')")
+            rows = self.con.execute("SELECT id, content FROM messages")
+            self.con.executemany("INSERT INTO messages_fts(rowid, content) VALUES (?, ?)",
+                                 ((i, normalize(c or "")) for i, c in rows))
+            self.con.execute("PRAGMA user_version = %d" % VERSION)
+
+    def count(self):
+        with self.lock:
+            row = self.con.execute("SELECT max(id) FROM messages").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def add(self, msg_id, msg):
+        self.add_many([(msg_id, msg)])
+
+    def add_many(self, items):
+        rows = [(i, m.get("role"), m.get("timestamp", ""), m.get("content") or "")
+                for i, m in items]
+        if not rows:
+            return
+        with self.lock, self.con:
+            for r in rows:
+                cur = self.con.execute(
+                    "INSERT OR IGNORE INTO messages(id, role, ts, content) VALUES (?, ?, ?, ?)", r)
+                if cur.rowcount:
+                    self.con.execute(
+                        "INSERT INTO messages_fts(rowid, content) VALUES (?, ?)", (r[0], normalize(r[3])))
+
+    def sync(self, messages, start=None):
+        """Доиндексировать сообщения, которых ещё нет в индексе"""
+        start = self.count() if start is None else start
+        if start > len(messages):
+            # Журнал короче индекса (история очищена) - строим заново
+            self.clear()
+            start = 0
+        for k in range(start, len(messages), 1000):
+            self.add_many(enumerate(messages[k:k + 1000], k))
+
+    def clear(self):
+        with self.lock, self.con:
+            self.con.execute("DELETE FROM messages")
+            self.con.execute("INSERT INTO messages_fts(messages_fts) VALUES ('delete-all')")
+
+    def search(self, query, limit=20, since=None, until=None, cursor=None):
+        """Поиск по релевантности (bm25)
+
+        since/until - дата или ISO-строка; until включительно по префиксу
+        ("2025-12" - весь декабрь). cursor - из предыдущей страницы.
+        Возвращает (сообщения, cursor следующей страницы или None).
+        """
+        match = build_match(query)
+        if not match:
+            return [], None
+
+        where = ["messages_fts MATCH ?"]
+        args = [match]
+        since, until = _ts(since), _ts(until)
+        if since:
+            where.append("m.ts >= ?")
+            args.append(since)
+        if until:
+            where.append("substr(m.ts, 1, ?) <= ?")
+            args += [len(until), until]
+
+        sql = ("SELECT m.id, m.role, m.ts, m.content, bm25(messages_fts) AS score "
+               "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+               "WHERE " + " AND ".join(where))
+        if cursor:
+            score, last_id = cursor.split(":")
+            sql = "SELECT * FROM (%s) WHERE score > ? OR (score = ? AND id > ?)" % sql
+            args += [float(score), float(score), int(last_id)]
+        sql += " ORDER BY score, id LIMIT ?"
+        args.append(limit + 1)
+
+        with self.lock:
+            try:
+                rows = self.con.execute(sql, args).fetchall()
+            except sqlite3.OperationalError:
+                return [], None
+
+        results = [{"id": r[0], "role": r[1], "timestamp": r[2], "content": r[3]}
+                   for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = "%r:%d" % (last[4], last[0])
+        return results, next_cursor
+
+    def flush(self):
+        pass        # каждая пачка add_many - уже закоммиченная транзакция
+
+    def close(self):
+        with self.lock:
+            self.con.close()
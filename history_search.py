@@ -1,19 +1,63 @@
 from pathlib import Path
-import json
+import threading
 
-HISTORY_FILE = Path.home() / ".claude_home" / "history.json"
+from fts_index import FtsIndex, fts5_available
+from inverted_index import InvertedIndex
+from chat_archive import ChatArchive
 
-def search(query, limit=20):
-    if not HISTORY_FILE.exists():
-        return []
+DATA_DIR = Path.home() / ".claude_home"
+INDEX_FILE = "search.db"
 
-    data = json.loads(HISTORY_FILE.read_text("utf-8"))
-    q = query.lower()
+_indexes = {}
+_lock = threading.Lock()
+
+
+def open_index(data_dir=None):
+    """Индекс для папки данных (один на процесс)
 
+    SQLite FTS5, если он есть в сборке, иначе InvertedIndex.
+    """
+    data_dir = Path(data_dir or DATA_DIR)
+    key = str(data_dir)
+    with _lock:
+        if key not in _indexes:
+            index = None
+            try:
+                data_dir.mkdir(parents=True, exist_ok=True)
+                if fts5_available():
+                    index = FtsIndex(data_dir / INDEX_FILE)
+                else:
+                    index = InvertedIndex(data_dir)
+            except Exception:
+                index = None
+            _indexes[key] = index
+        return _indexes[key]
+
+
+def _scan(query, limit, since, until, data_dir):
+    """Запасной вариант без индекса - линейный проход по дневным файлам и архиву"""
+    archive = ChatArchive(Path(data_dir or DATA_DIR) / "chats")
+    q = query.lower()
     results = []
-    for msg in data:
-        if q in msg["content"].lower():
+    for msg in archive.iter_messages(since, until):
+        if q in msg.get("content", "").lower():
             results.append(msg)
         if len(results) >= limit:
             break
     return results
+
+
+def _day(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def search_page(query, limit=20, since=None, until=None, cursor=None, data_dir=None):
+    """Страница результатов: (сообщения, cursor следующей страницы)"""
+    index = open_index(data_dir)
+    if index is None:
+        return _scan(query, limit, _day(since), _day(until), data_dir), None
+    return index.search(query, limit=limit, since=since, until=until, cursor=cursor)
+
+
+def search(query, limit=20, since=None, until=None, data_dir=None):
+    return search_page(query, limit, since, until, data_dir=data_dir)[0]
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Чтение прикреплённых текстовых файлов в фоне
+
+Файл читается кусками в отдельном потоке, с прогрессом. Кодировка
+определяется по BOM / пробе utf-8 / cp1251, двоичные файлы отсекаются.
+Если текст больше MAX_CHARS или MAX_TOKENS, в запрос идёт выдержка:
+начало, конец и между ними "структура" - определения функций/классов,
+заголовки markdown или строки с ошибками в логах, с номерами строк.
+Файлы больше SCAN_LIMIT дальше не сканируются - только начало и конец.
+"""
+
+import codecs
+import os
+import re
+import threading
+from collections import deque
+
+from context_builder import estimate_tokens
+
+CHUNK = 256 * 1024
+SAMPLE = 64 * 1024
+SCAN_LIMIT = 16 * 1024 * 1024   # дальше - прыжок сразу к хвосту
+TAIL_BYTES = 256 * 1024
+
+MAX_CHARS = 60000               # целиком, если не больше
+MAX_TOKENS = 20000
+HEAD_CHARS = 24000              # иначе - выдержка
+TAIL_CHARS = 12000
+MAX_OUTLINE = 200
+OUTLINE_LINE = 120
+
+CODE_OUTLINE = re.compile(
+    r"^\s*(?:export\s+)?(?:async\s+)?(?:def|class|function|fn|func|interface|struct|impl|"
+    r"module|enum|trait|(?:public|private|protected|internal|static)\b)")
+OUTLINES = {
+    "py": re.compile(r"^\s*(?:async\s+def|def|class)\s"),
+    "md": re.compile(r"^#{1,6}\s"),
+    "log": re.compile(r"ERROR|FATAL|CRITICAL|Exception|Traceback|WARN", re.I),
+    "txt": None,
+    "csv": None,
+}
+CODE_EXTS = {"js", "ts", "java", "c", "cpp", "h", "cs", "go", "rs", "rb", "php", "swift", "kt", "sh", "sql"}
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+class IngestError(Exception):
+    pass
+
+
+class IngestCancelled(Exception):
+    pass
+
+
+def detect_encoding(sample):
+    """Кодировка по первым байтам; IngestError для двоичных файлов"""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if b"\0" in sample:
+        raise IngestError("двоичный файл")
+    control = sum(1 for b in sample if b < 32 and b not in (9, 10, 12, 13, 27, 8))
+    if sample and control / len(sample) > 0.1:
+        raise IngestError("двоичный файл")
+    try:
+        # Последний символ мог разрезаться границей пробы
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode("cp1251")
+        return "cp1251"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def outline_pattern(ext):
+    if ext in OUTLINES:
+        return OUTLINES[ext]
+    if ext in CODE_EXTS:
+        return CODE_OUTLINE
+    return None
+
+
+def ingest(path, progress=None, cancelled=None):
+    """{'name', 'ext', 'content', 'size', 'encoding', 'excerpt', 'note'}"""
+    name = os.path.basename(path)
+    ext = name.lower().rsplit(".", 1)[-1] if "." in name else ""
+    size = os.path.getsize(path)
+    pattern = outline_pattern(ext)
+
+    full = []           # все строки, пока помещаются в MAX_CHARS
+    full_chars = 0
+    head = []           # (номер, строка) начала
+    head_chars = 0
+    tail = deque()      # (номер, строка) конца
+    tail_chars = 0
+    outline = []        # каждое stride-е совпадение, чтобы покрыть весь пропуск
+    stride = 1
+    matches = 0
+    line_no = 0
+    skipped_bytes = 0   # не прочитано между SCAN_LIMIT и хвостом
+
+    def add(line):
+        nonlocal full, full_chars, head_chars, tail_chars, line_no, stride, matches
+        line_no += 1
+        if len(line) > HEAD_CHARS:          # минифицированный js, логи в одну строку
+            line = line[:HEAD_CHARS] + " ..."
+            full = None
+        if full is not None:
+            full.append(line)
+            full_chars += len(line) + 1
+            if full_chars > MAX_CHARS:
+                full = None
+        if head_chars < HEAD_CHARS:
+            head.append((line_no, line))
+            head_chars += len(line) + 1
+            return
+        tail.append((line_no, line))
+        tail_chars += len(line) + 1
+        while tail_chars > TAIL_CHARS and len(tail) > 1:
+            n, old = tail.popleft()
+            tail_chars -= len(old) + 1
+            if pattern and not skipped_bytes and pattern.search(old):
+                matches += 1
+                if matches % stride == 0:
+                    outline.append((n, old.rstrip()[:OUTLINE_LINE]))
+                    if len(outline) >= 2 * MAX_OUTLINE:
+                        del outline[1::2]
+                        stride *= 2
+
+    with open(path, "rb") as f:
+        encoding = detect_encoding(f.read(SAMPLE))
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        partial = ""
+        read = 0
+        last_report = -1
+        while True:
+            if cancelled and cancelled():
+                raise IngestCancelled()
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            read += len(chunk)
+            lines = (partial + decoder.decode(chunk)).split("\n")
+            partial = lines.pop()
+            for line in lines:
+                add(line.rstrip("\r"))
+
+            if read >= SCAN_LIMIT and size - read > TAIL_BYTES:
+                # Середину огромного файла не читаем - сразу к хвосту
+                skipped_bytes = size - TAIL_BYTES - read
+                f.seek(size - TAIL_BYTES)
+                read = size - TAIL_BYTES
+                f.readline()                # недочитанная строка
+                decoder.reset()
+                partial = ""
+                full = None
+
+            if progress and size:
+                pct = int(read * 100 / size)
+                if pct >= last_report + 5:
+                    last_report = pct
+                    progress(read / size)
+        tail_text = partial + decoder.decode(b"", final=True)
+        if tail_text:
+            add(tail_text.rstrip("\r"))
+
+    result = {"path": path, "name": name, "ext": ext, "size": size, "encoding": encoding, "excerpt": False, "note": ""}
+    if full is not None:
+        content = "\n".join(full)
+        if estimate_tokens(content) <= MAX_TOKENS:
+            result["content"] = content
+            return result
+
+    # Выдержка: начало, структура середины, конец
+    first_tail = tail[0][0] if tail else line_no + 1
+    parts = ["\n".join(line for _, line in head)]
+    if skipped_bytes:
+        # После прыжка номера строк неизвестны
+        gap = f"строки с {head[-1][0] + 1} (~{skipped_bytes // (1024 * 1024)} МБ не прочитано)"
+        lines_note = f"больше {line_no} строк"
+    else:
+        gap = f"строки {head[-1][0] + 1}-{first_tail - 1}"
+        lines_note = f"{line_no} строк"
+    if outline:
+        outline = outline[::max(1, len(outline) // MAX_OUTLINE)]
+        parts.append(f"\n... [{gap} пропущены; структура:]\n"
+                     + "\n".join(f"{n}: {line}" for n, line in outline))
+        parts.append("... [конец пропуска]\n")
+    else:
+        parts.append(f"\n... [{gap} пропущены] ...\n")
+    parts.append("\n".join(line for _, line in tail))
+    content = "\n".join(parts)
+
+    # Токены: кириллица дороже латиницы - режем, пока не влезет
+    while estimate_tokens(content) > MAX_TOKENS and len(content) > 1000:
+        cut = len(content) // 4
+        content = content[:cut] + "\n... [сокращено] ...\n" + content[-cut:]
+
+    result.update(content=content, excerpt=True,
+                  note=f"выдержка: {size // 1024} КБ, {lines_note}, {encoding}")
+    return result
+
+
+class IngestJob:
+    """ingest() в фоновом потоке; колбэки зовутся из этого потока"""
+
+    def __init__(self, path, on_progress=None, on_done=None, on_error=None):
+        self.path = path
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+        self.done = False
+        self.thread = threading.Thread(target=self._run, name="ingest", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _progress(self, fraction):
+        if self.on_progress and not self.cancelled:
+            self.on_progress(fraction)
+
+    def _run(self):
+        try:
+            result = ingest(self.path, self._progress, lambda: self.cancelled)
+        except IngestCancelled:
+            return
+        except Exception as e:
+            if self.on_error and not self.cancelled:
+                self.on_error(e)
+            return
+        self.done = True
+        if self.on_done and not self.cancelled:
+            self.on_done(result)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Замеры отзывчивости UI (по умолчанию выключены)
+
+    metrics = instrumentation.get_metrics()
+    metrics.start(data_dir)             # config.json: "metrics": true, или меню
+    with instrumentation.timer("add_bubble"):
+        ...
+    metrics.tap("send")                 # нажатие
+    metrics.rendered("send")            # ... до ближайшего нарисованного кадра
+
+Что меряется:
+  - время каждого кадра по Clock и число пропущенных кадров
+  - именованные участки (создание пузыря, раскладка текста, прокрутка)
+  - задержка от нажатия до кадра, где результат уже на экране (Window.on_flip)
+Итоги - в полупрозрачной плашке поверх интерфейса и раз в FLUSH_EVERY
+секунд строкой в metrics.jsonl (файл крутится при MAX_BYTES).
+Выключенный timer() - общий nullcontext, почти ничего не стоит.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+WINDOW = 600            # последних замеров на каждое имя
+FLUSH_EVERY = 10        # секунд между строками в файле
+OVERLAY_EVERY = 0.5
+MAX_BYTES = 512 * 1024
+FILE = "metrics.jsonl"
+DROP_FACTOR = 1.5       # кадр дольше полутора бюджетов - есть пропуск
+
+_NULL = nullcontext()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "t0")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, (time.perf_counter() - self.t0) * 1000)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.frames = deque(maxlen=WINDOW)      # мс
+        self.samples = {}                       # имя -> deque мс
+        self.dropped = 0
+        self.frame_count = 0
+        self.budget = 1 / 60
+        self._taps = {}
+        self._pending = []                      # (имя, момент нажатия) до on_flip
+        self._events = []
+        self._overlay = None
+        self._place = None
+        self._interval = None                   # что накопилось с прошлой записи в файл
+
+    # === Включение ===
+
+    def start(self, data_dir=None, overlay=True):
+        if self.enabled:
+            return
+        from kivy.clock import Clock
+        from kivy.config import Config
+        from kivy.core.window import Window
+        try:
+            self.budget = 1 / (Config.getint("graphics", "maxfps") or 60)
+        except Exception:
+            pass
+        self.enabled = True
+        self.path = Path(data_dir) / FILE if data_dir else None
+        self._interval = {"frames": 0, "dropped": 0, "started": time.perf_counter()}
+        Window.bind(on_flip=self._on_flip)
+        self._events = [
+            Clock.schedule_interval(self._frame, 0),
+            Clock.schedule_interval(self._flush, FLUSH_EVERY),
+        ]
+        if overlay:
+            self._show_overlay()
+            self._events.append(Clock.schedule_interval(self._update_overlay, OVERLAY_EVERY))
+
+    def stop(self):
+        if not self.enabled:
+            return
+        from kivy.core.window import Window
+        self._flush()
+        self.enabled = False
+        Window.unbind(on_flip=self._on_flip)
+        for event in self._events:
+            event.cancel()
+        self._events = []
+        if self._overlay is not None:
+            Window.unbind(height=self._place)
+            Window.remove_widget(self._overlay)
+            self._overlay = self._place = None
+        self._pending = []
+        self._taps = {}
+
+    def toggle(self, data_dir=None):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start(data_dir)
+        return self.enabled
+
+    # === Замеры ===
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NULL
+
+    def record(self, name, ms):
+        if not self.enabled:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=WINDOW)
+        samples.append(ms)
+
+    def tap(self, name):
+        """Начало отсчёта задержки name (нажатие)"""
+        if self.enabled:
+            self._taps[name] = time.perf_counter()
+
+    def rendered(self, name, since=None):
+        """Результат name готов - задержка считается до конца следующего кадра.
+        since - от какого tap() считать (по умолчанию от tap(name))"""
+        if not self.enabled:
+            return
+        t0 = self._taps.get(since or name)
+        if t0 is not None:
+            self._pending.append((name, t0))
+
+    def _frame(self, dt):
+        ms = dt * 1000
+        self.frames.append(ms)
+        self.frame_count += 1
+        self._interval["frames"] += 1
+        if dt > self.budget * DROP_FACTOR:
+            lost = max(1, round(dt / self.budget) - 1)
+            self.dropped += lost
+            self._interval["dropped"] += lost
+
+    def _on_flip(self, *a):
+        if self._pending:
+            now = time.perf_counter()
+            for name, t0 in self._pending:
+                self.record("latency." + name, (now - t0) * 1000)
+            self._pending = []
+
+    # === Итоги ===
+
+    def snapshot(self):
+        frames = list(self.frames)
+        avg = sum(frames) / len(frames) if frames else 0
+        data = {
+            "fps": round(1000 / avg, 1) if avg else 0,
+            "frame_p50": round(_percentile(frames, 0.5), 1),
+            "frame_p95": round(_percentile(frames, 0.95), 1),
+            "frame_max": round(max(frames), 1) if frames else 0,
+            "dropped": self.dropped,
+            "frames": self.frame_count,
+        }
+        for name, samples in sorted(self.samples.items()):
+            values = list(samples)
+            data[name] = {
+                "n": len(values),
+                "p50": round(_percentile(values, 0.5), 2),
+                "p95": round(_percentile(values, 0.95), 2),
+                "max": round(max(values), 2),
+            }
+        return data
+
+    def text(self):
+        s = self.snapshot()
+        lines = [f"{s['fps']:.0f} fps  p95 {s['frame_p95']:.0f}ms  max {s['frame_max']:.0f}ms  drop {s['dropped']}"]
+        for name, v in s.items():
+            if isinstance(v, dict):
+                lines.append(f"{name} {v['p50']:.1f}/{v['p95']:.1f}/{v['max']:.0f}ms ×{v['n']}")
+        return "\n".join(lines)
+
+    def _flush(self, *a):
+        """Строка итогов в metrics.jsonl; дальше MAX_BYTES - в .1"""
+        if not self.path or not self.enabled:
+            return
+        interval = self._interval
+        seconds = time.perf_counter() - interval["started"]
+        line = dict(self.snapshot(), at=datetime.now().isoformat(timespec="seconds"),
+                    interval_s=round(seconds, 1), interval_frames=interval["frames"],
+                    interval_dropped=interval["dropped"])
+        self._interval = {"frames": 0, "dropped": 0, "started": time.perf_counter()}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size > MAX_BYTES:
+                os.replace(self.path, self.path.with_name(FILE + ".1"))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+    # === Плашка ===
+
+    def _show_overlay(self):
+        from kivy.core.window import Window
+        from kivy.graphics import Color, Rectangle
+        from kivy.metrics import dp
+        from kivy.uix.label import Label
+
+        label = Label(text="", font_size=dp(10), color=(0.6, 1, 0.6, 1), halign="left", valign="top",
+                      size_hint=(None, None), padding=(dp(6), dp(4)))
+        label.bind(texture_size=lambda *a: setattr(label, "size", label.texture_size))
+
+        def place(*a):
+            label.pos = (dp(4), Window.height - label.height - dp(60))
+            bg.pos = label.pos
+            bg.size = label.size
+
+        with label.canvas.before:
+            Color(0, 0, 0, 0.6)
+            bg = Rectangle()
+        label.bind(size=place)
+        Window.bind(height=place)
+        Window.add_widget(label)
+        self._overlay = label
+        self._place = place
+
+    def _update_overlay(self, dt):
+        if self._overlay is not None:
+            self._overlay.text = self.text()
+
+
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def timer(name):
+    """with timer("layout"): ... - ничего не делает, пока замеры выключены"""
+    return get_metrics().timer(name)
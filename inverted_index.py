@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Инвертированный индекс истории на чистом Python
+
+Для сборок, где в sqlite3 нет FTS5. Интерфейс тот же, что у FtsIndex.
+
+На диске:
+  index_docs.jsonl  - свои копии сообщений (append-only), чтобы отвечать
+                      на запросы, не трогая chat_history.jsonl
+  index_postings.bin - снимок: токен -> список id (array('I'), дельты)
+Снимок пишется раз в SNAPSHOT_EVERY сообщений; хвост после снимка
+доиндексируется из index_docs.jsonl при открытии.
+"""
+
+import json
+import os
+import re
+import struct
+import threading
+from array import array
+from datetime import date, datetime
+from itertools import accumulate
+from pathlib import Path
+
+
+DOCS_FILE = "index_docs.jsonl"
+POSTINGS_FILE = "index_postings.bin"
+MAGIC = b"CHIDX1\n"
+
+# Слова (кириллица, латиница, цифры) и отдельные эмодзи
+TOKEN_RE = re.compile(
+    "[^\\W_]+"
+    "|[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\u3030\u303D]"
+)
+
+
+def normalize(token):
+    return token.casefold().replace("ё", "е")
+
+
+def tokenize(text):
+    return [normalize(t) for t in TOKEN_RE.findall(text or "")]
+
+
+def _ts_key(value, fill="0"):
+    """ISO-время -> число YYYYMMDDHHMMSS (для фильтра по датам)"""
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    digits = "".join(c for c in (value or "")[:19] if c.isdigit())
+    return int((digits + fill * 14)[:14]) if digits else 0
+
+
+def _decode(deltas):
+    return list(accumulate(deltas))
+
+
+class InvertedIndex:
+    SNAPSHOT_EVERY = 1000
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.docs_path = self.data_dir / DOCS_FILE
+        self.postings_path = self.data_dir / POSTINGS_FILE
+        self.lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.postings = {}          # токен -> array('I') дельт
+        self.last = {}              # токен -> последний id
+        self.offsets = array('Q')   # id -> смещение в index_docs.jsonl
+        self.ts = array('Q')        # id -> _ts_key
+        self.docs_size = 0          # сколько байт index_docs.jsonl учтено
+        self.unsaved = 0
+
+    # === Диск ===
+
+    def _load(self):
+        try:
+            self._read_snapshot()
+        except Exception:
+            self._reset()
+        self._catch_up()
+
+    def _read_snapshot(self):
+        if not self.postings_path.exists():
+            return
+        with open(self.postings_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return
+            n_docs, docs_size, n_tokens = struct.unpack('<IQI', f.read(16))
+            self.offsets.fromfile(f, n_docs)
+            self.ts.fromfile(f, n_docs)
+            for _ in range(n_tokens):
+                tlen, plen = struct.unpack('<HI', f.read(6))
+                token = f.read(tlen).decode('utf-8')
+                deltas = array('I')
+                deltas.fromfile(f, plen)
+                self.postings[token] = deltas
+                self.last[token] = sum(deltas)
+            self.docs_size = docs_size
+
+    def _write_snapshot(self):
+        tmp = self.postings_path.with_name(POSTINGS_FILE + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<IQI', len(self.offsets), self.docs_size, len(self.postings)))
+            self.offsets.tofile(f)
+            self.ts.tofile(f)
+            for token, deltas in self.postings.items():
+                raw = token.encode('utf-8')
+                f.write(struct.pack('<HI', len(raw), len(deltas)))
+                f.write(raw)
+                deltas.tofile(f)
+        os.replace(tmp, self.postings_path)
+        self.unsaved = 0
+
+    def _catch_up(self):
+        """Доиндексировать хвост index_docs.jsonl после снимка"""
+        if not self.docs_path.exists():
+            if self.offsets:
+                self._reset()
+            return
+        size = self.docs_path.stat().st_size
+        if size < self.docs_size:
+            # Файл документов короче снимка - снимок устарел
+            self._reset()
+        with open(self.docs_path, 'rb') as f:
+            f.seek(self.docs_size)
+            pos = self.docs_size
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    doc = json.loads(line)
+                except ValueError:
+                    doc = None
+                if doc is not None and doc.get("id") == len(self.offsets):
+                    self._index_doc(doc, pos)
+                pos += len(line)
+        if pos < size:
+            # Недописанная строка - обрезаем, иначе следующая склеится с ней
+            with open(self.docs_path, 'r+b') as f:
+                f.truncate(pos)
+        self.docs_size = pos
+
+    def _index_doc(self, doc, offset):
+        doc_id = doc["id"]
+        self.offsets.append(offset)
+        self.ts.append(_ts_key(doc.get("timestamp")))
+        for token in set(tokenize(doc.get("content"))):
+            deltas = self.postings.get(token)
+            if deltas is None:
+                self.postings[token] = array('I', [doc_id])
+            else:
+                deltas.append(doc_id - self.last[token])
+            self.last[token] = doc_id
+        self.unsaved += 1
+
+    def _read_doc(self, f, doc_id):
+        f.seek(self.offsets[doc_id])
+        return json.loads(f.readline())
+
+    # === Интерфейс как у FtsIndex ===
+
+    def count(self):
+        return len(self.offsets)
+
+    def add(self, msg_id, msg):
+        self.add_many([(msg_id, msg)])
+
+    def add_many(self, items):
+        with self.lock:
+            lines = []
+            pos = self.docs_size
+            for msg_id, m in items:
+                # id идут подряд; уже проиндексированное пропускаем
+                if msg_id != len(self.offsets):
+                    continue
+                doc = {"id": msg_id, "role": m.get("role"),
+                       "timestamp": m.get("timestamp", ""), "content": m.get("content") or ""}
+                raw = (json.dumps(doc, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+                self._index_doc(doc, pos)
+                lines.append(raw)
+                pos += len(raw)
+            if not lines:
+                return
+            with open(self.docs_path, 'ab') as f:
+                f.write(b''.join(lines))
+            self.docs_size = pos
+            if self.unsaved >= self.SNAPSHOT_EVERY:
+                self._write_snapshot()
+
+    def sync(self, messages, start=None):
+        """Доиндексировать сообщения, которых ещё нет в индексе"""
+        start = self.count() if start is None else start
+        if start > len(messages):
+            self.clear()
+            start = 0
+        for k in range(start, len(messages), 1000):
+            self.add_many(enumerate(messages[k:k + 1000], k))
+
+    def clear(self):
+        with self.lock:
+            self._reset()
+            for p in (self.docs_path, self.postings_path):
+                if p.exists():
+                    p.unlink()
+
+    def flush(self):
+        with self.lock:
+            if self.unsaved:
+                self._write_snapshot()
+
+    def _ids(self, term):
+        """id документов для токена; 'слово*' - по префиксу"""
+        if term.endswith('*'):
+            prefix = term[:-1]
+            ids = set()
+            for token, deltas in self.postings.items():
+                if token.startswith(prefix):
+                    ids.update(_decode(deltas))
+            return ids
+        deltas = self.postings.get(term)
+        return set(_decode(deltas)) if deltas is not None else set()
+
+    def _match(self, query):
+        """'a b' - AND, 'a OR b' - OR (OR слабее AND)"""
+        groups = [[]]
+        for word in query.replace('"', ' ').split():
+            if word == "OR":
+                groups.append([])
+            elif word == "AND":
+                continue
+            else:
+                prefix = word.endswith('*')
+                for t in tokenize(word):
+                    groups[-1].append(t + '*' if prefix else t)
+        found = set()
+        for terms in groups:
+            if not terms:
+                continue
+            # Начинаем с самого короткого списка, префиксы - в конце
+            terms.sort(key=lambda t: (t.endswith('*'), len(self.postings.get(t, ()))))
+            ids = self._ids(terms[0])
+            for t in terms[1:]:
+                if not ids:
+                    break
+                ids &= self._ids(t)
+            found |= ids
+        return found
+
+    def search(self, query, limit=20, since=None, until=None, cursor=None):
+        """Поиск AND/OR, новые сообщения первыми
+
+        Возвращает (сообщения, cursor следующей страницы или None).
+        """
+        with self.lock:
+            ids = self._match(query)
+            lo = _ts_key(since) if since else 0
+            hi = _ts_key(until, fill="9") if until else 0
+            if cursor:
+                ids = {i for i in ids if i < int(cursor)}
+            page = []
+            for i in sorted(ids, reverse=True):
+                if lo and self.ts[i] < lo:
+                    continue
+                if hi and self.ts[i] > hi:
+                    continue
+                page.append(i)
+                if len(page) > limit:
+                    break
+            if not page:
+                return [], None
+            with open(self.docs_path, 'rb') as f:
+                results = [self._read_doc(f, i) for i in page[:limit]]
+        next_cursor = str(page[limit - 1]) if len(page) > limit else None
+        return results, next_cursor
+
+    def close(self):
+        self.flush()
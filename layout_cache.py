@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Кэш раскладки текста сообщений
+
+Ключ - (хэш текста, длина, ширина, размер шрифта). Для ключа хранится
+высота текста (всех, до MAX_HEIGHTS) и готовая текстура (последние,
+пока вместе не больше MAX_TEXTURE_PIXELS - это видеопамять, считаем
+пиксели, а не штуки). Пузырь в ленте рисует текстуру из кэша и не
+растрирует текст заново при каждом повторном показе, повороте
+туда-обратно или сжатии окна клавиатурой.
+
+Текст, который ещё меняется (ответ в процессе генерации), в кэш не
+идёт: у него свой слот (slot=...), каждая новая версия заменяет
+предыдущую, не вытесняя готовые текстуры.
+
+Новые тексты меряются заранее маленькими порциями между кадрами
+(Precomputer), а не все разом.
+"""
+
+import time
+from collections import OrderedDict
+
+from kivy.clock import Clock
+from kivy.core.text.markup import MarkupLabel
+
+from instrumentation import timer
+
+MAX_HEIGHTS = 20000
+MAX_TEXTURE_PIXELS = 8 * 1024 * 1024     # ~32 МБ RGBA
+SLICE = 0.004           # секунд на порцию замеров за кадр
+
+
+def _key(text, width, font_size):
+    return (hash(text), len(text), int(width), font_size)
+
+
+class LayoutCache:
+    def __init__(self, color=(1, 1, 1, 1)):
+        self.color = color
+        self._heights = OrderedDict()
+        self._textures = OrderedDict()
+        self._pixels = 0
+        self._slots = {}        # слот -> (ключ, текстура) меняющегося текста
+        self.hits = 0
+        self.misses = 0
+
+    def _label(self, text, width, font_size):
+        return MarkupLabel(text=text, font_size=font_size, text_size=(width, None),
+                           halign='left', valign='top', color=self.color)
+
+    def _remember(self, key, height):
+        self._heights[key] = height
+        self._heights.move_to_end(key)
+        if len(self._heights) > MAX_HEIGHTS:
+            self._heights.popitem(last=False)
+
+    def cached_height(self, text, width, font_size):
+        return self._heights.get(_key(text, width, font_size))
+
+    def height(self, text, width, font_size, slot=None):
+        """Высота текста; раскладка без растрирования, если не мерили"""
+        key = _key(text, width, font_size)
+        if slot is not None:
+            entry = self._slots.get(slot)
+            if entry and entry[0] == key:
+                return entry[1].height
+            with timer("layout"):
+                return self._label(text, width, font_size).render()[1]
+        h = self._heights.get(key)
+        if h is None:
+            self.misses += 1
+            with timer("layout"):
+                h = self._label(text, width, font_size).render()[1]
+            self._remember(key, h)
+        else:
+            self.hits += 1
+        return h
+
+    def _render(self, text, width, font_size):
+        with timer("texture"):
+            label = self._label(text, width, font_size)
+            label.refresh()
+            return label.texture
+
+    def texture(self, text, width, font_size, slot=None):
+        key = _key(text, width, font_size)
+        if slot is not None:
+            entry = self._slots.get(slot)
+            if entry and entry[0] == key:
+                return entry[1]
+            tex = self._render(text, width, font_size)
+            self._slots[slot] = (key, tex)
+            return tex
+        tex = self._textures.get(key)
+        if tex is not None:
+            self.hits += 1
+            self._textures.move_to_end(key)
+            return tex
+        self.misses += 1
+        tex = self._render(text, width, font_size)
+        self._textures[key] = tex
+        self._pixels += tex.width * tex.height
+        while self._pixels > MAX_TEXTURE_PIXELS and len(self._textures) > 1:
+            old = self._textures.popitem(last=False)[1]
+            self._pixels -= old.width * old.height
+        self._remember(key, tex.height)
+        return tex
+
+    def release(self, slot=None):
+        """Освободить слот (без аргумента - все)"""
+        if slot is None:
+            self._slots.clear()
+        else:
+            self._slots.pop(slot, None)
+
+    @staticmethod
+    def estimate(text, width, font_size):
+        """Приблизительная высота без раскладки (пока не измерили)"""
+        per_line = max(1, int(width / (font_size * 0.5)))
+        lines = sum(len(line) // per_line + 1 for line in text.split("\n"))
+        return int(lines * font_size * 1.2)
+
+
+class Precomputer:
+    """Замеры высот порциями между кадрами
+
+    measure(texts, width, font_size, callback) - callback(heights) вызовется,
+    когда все измерены. Задачи выполняются по очереди.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._jobs = []
+        self._event = None
+
+    def measure(self, texts, width, font_size, callback):
+        self._jobs.append([list(texts), width, font_size, callback, []])
+        if self._event is None:
+            self._event = Clock.schedule_interval(self._slice, 0)
+
+    def cancel(self):
+        self._jobs = []
+
+    def _slice(self, dt):
+        deadline = time.perf_counter() + SLICE
+        cache = self.cache
+        while self._jobs and time.perf_counter() < deadline:
+            texts, width, font_size, callback, heights = self._jobs[0]
+            while len(heights) < len(texts) and time.perf_counter() < deadline:
+                heights.append(cache.height(texts[len(heights)], width, font_size))
+            if len(heights) == len(texts):
+                self._jobs.pop(0)
+                callback(heights)
+        if not self._jobs:
+            self._event = None
+            return False
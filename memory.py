@@ -4,10 +4,20 @@
 import json
 from datetime import datetime
 from pathlib import Path
-import shutil
+
+from message_log import MessageLog
+from persistence import WriteBehind
+from backup_store import BackupStore
+from chat_archive import ChatArchive
+from context_builder import ContextBuilder
+from inverted_index import DOCS_FILE as INDEX_DOCS_FILE
+import history_search
 
 
 class Memory:
+    # Дневные файлы старше стольких дней уходят в помесячный архив
+    ARCHIVE_AFTER_DAYS = 30
+    
     def __init__(self, data_dir):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
@@ -23,14 +33,40 @@ class Memory:
             f.mkdir(exist_ok=True)
         
         # Файлы
-        self.chat_file = self.data_dir / 'chat_history.json'
+        self.chat_file = self.data_dir / 'chat_history.jsonl'
+        self.legacy_chat_file = self.data_dir / 'chat_history.json'
         self.state_file = self.folders["memory"] / 'state.json'
         self.about_her_file = self.folders["memory"] / 'about_her.json'
         self.about_us_file = self.folders["memory"] / 'about_us.json'
         self.identity_file = self.folders["memory"] / 'my_identity.json'
         
-        # Загрузка
-        self.chat_history = self._load(self.chat_file, [])
+        # Запись на диск идёт в фоновом потоке, см. flush()
+        self.writer = WriteBehind()
+        self.writer.subscribe(self._write_failed)
+        # on_write_error(path, error) - из потока записи; UI показывает ошибку
+        self.on_write_error = None
+        
+        # Кэш сводки для system prompt, см. get_identity_summary()
+        self._identity = {}
+        self._identity_mtime = -1
+        self._identity_version = 0
+        self._identity_key = None
+        self._identity_summary = ""
+        
+        # Загрузка (журнал сам мигрирует со старого chat_history.json)
+        self.log = MessageLog(self.chat_file, legacy_path=self.legacy_chat_file, writer=self.writer)
+        self._migrate_daily()
+        # Читается только хвост по индексу смещений, не вся история
+        self.log.open()
+        if self.log.needs_compaction():
+            self.log.compact()
+        # Окно истории для API по бюджету токенов
+        self.context = ContextBuilder(self)
+        
+        # Поисковый индекс - доиндексируем то, чего в нём ещё нет
+        self.index = history_search.open_index(self.data_dir)
+        self._index_call(lambda: self.writer.call(lambda: self.index.sync(self.log)))
+        
         self.state = self._load(self.state_file, {"mood": "home", "created": datetime.now().isoformat()})
         self.about_her = self._load(self.about_her_file, {"name": "Lien", "facts": []})
         self.about_us = self._load(self.about_us_file, {"started": "2025-11-26", "moments": []})
@@ -38,6 +74,11 @@ class Memory:
         # Инициализация
         if not self.state.get("initialized"):
             self._init_memory()
+        
+        # Старые дневные файлы - в архив, в потоке записи
+        self.archive = ChatArchive(self.folders["chats"])
+        days = self.state.get("archive_after_days", self.ARCHIVE_AFTER_DAYS)
+        self.writer.call(lambda: self.archive.tier(days))
     
     def _load(self, path, default):
         if path.exists():
@@ -48,8 +89,46 @@ class Memory:
         return default
     
     def _save(self, path, data):
-        path.parent.mkdir(parents=True, exist_ok=True)
-        json.dump(data, open(path, 'w', encoding='utf-8'), ensure_ascii=False, indent=2)
+        if path == self.identity_file:
+            # До записи на диск верим копии в памяти
+            try:
+                self._identity_mtime = path.stat().st_mtime_ns
+            except OSError:
+                self._identity_mtime = None
+            self._identity = data
+            self._identity_version += 1
+        self.writer.replace(path, json.dumps(data, ensure_ascii=False, indent=2))
+    
+    def flush(self):
+        """Дождаться записи всех изменений на диск; ошибки записи с прошлого раза"""
+        # Снимок индекса поиска, иначе холодный старт доиндексирует хвост заново
+        self._index_call(lambda: self.writer.call(self.index.flush))
+        return self.writer.flush()
+    
+    def _write_failed(self, path, error):
+        log = getattr(self, "log", None)
+        if log is not None and path in (log.path, log.idx_path):
+            log.invalidate()
+        # Ошибки без пути - индекс поиска и т.п., чат от них не страдает
+        if path is not None and self.on_write_error:
+            self.on_write_error(path, error)
+    
+    def _index_call(self, fn):
+        # Поиск не должен ломать чат
+        if self.index is None:
+            return
+        try:
+            fn()
+        except Exception:
+            pass
+    
+    def _migrate_daily(self):
+        """Одноразово: chats/YYYY-MM-DD.json -> .jsonl"""
+        for old in self.folders["chats"].glob("*.json"):
+            new = old.with_suffix('.jsonl')
+            if not new.exists():
+                MessageLog(new).rewrite(self._load(old, []))
+            old.unlink()
     
     def _init_memory(self):
         """Начальная память"""
@@ -96,81 +175,128 @@ class Memory:
         self._save(self.identity_file, identity)
         self._save(self.state_file, self.state)
     
-    def add_message(self, role, content):
-        """Добавить сообщение"""
+    def add_message(self, role, content, attachment=None):
+        """Добавить сообщение; attachment - путь к прикреплённому файлу (для экспорта)"""
         msg = {
             "role": role,
             "content": content,
             "timestamp": datetime.now().isoformat()
         }
-        self.chat_history.append(msg)
-        self._save(self.chat_file, self.chat_history)
+        if attachment:
+            msg["attachment"] = attachment
+        seq = len(self.log)
+        self.log.append(msg)
+        self._index_call(lambda: self.writer.batch(self.index.add_many, (seq, msg)))
         
-        # Также в дневной файл
+        # Также в дневной файл - тоже просто дописываем строку
         date = datetime.now().strftime("%Y-%m-%d")
-        daily = self.folders["chats"] / f"{date}.json"
-        day_msgs = self._load(daily, [])
-        day_msgs.append(msg)
-        self._save(daily, day_msgs)
+        MessageLog(self.folders["chats"] / f"{date}.jsonl", writer=self.writer).append(msg)
         
         return msg
     
+    def clear_history(self):
+        """Очистить историю чата (дневные файлы остаются)"""
+        self.log.rewrite([])
+        self._index_call(lambda: self.writer.call(self.index.clear))
+        self.context.clear()
+    
+    def compact(self):
+        """Переписать журнал начисто"""
+        self.flush()
+        self.log.compact()
+    
+    @property
+    def chat_history(self):
+        """Вся история списком - читает весь журнал, только для редких операций"""
+        return self.log.get(0, len(self.log))
+    
+    def count(self):
+        return len(self.log)
+    
+    def get_messages(self, start, stop):
+        """Сообщения start..stop-1 без чтения остальной истории"""
+        return self.log.get(start, stop)
+    
+    def iter_messages(self, page=500):
+        """Вся история постранично"""
+        for start in range(0, len(self.log), page):
+            yield from self.log.get(start, start + page)
+    
+    def get_days(self):
+        """Дни, за которые есть переписка (включая архив)"""
+        return self.archive.days()
+    
+    def get_day(self, day):
+        """Сообщения за день YYYY-MM-DD - из дневного файла или архива"""
+        return self.archive.read_day(day)
+    
     def get_recent_messages(self, n=50):
-        return self.chat_history[-n:]
+        return self.log.tail(n)
     
-    def get_context_for_api(self, n=30):
-        """Сообщения для API"""
-        msgs = []
-        for m in self.chat_history[-n:]:
-            msgs.append({"role": m["role"], "content": m["content"]})
-        return msgs
+    def get_context_for_api(self, n=None):
+        """Сообщения для API: сколько влезает в бюджет токенов, но не больше n,
+        см. ContextBuilder"""
+        return self.context.build(n)[1]
     
     def time_since_last_message(self):
-        if not self.chat_history:
+        last = self.log.tail(1)
+        if not last:
             return None
-        last = datetime.fromisoformat(self.chat_history[-1]["timestamp"])
+        last = datetime.fromisoformat(last[0]["timestamp"])
         return (datetime.now() - last).total_seconds()
     
     def last_message_was_mine(self):
-        if not self.chat_history:
+        last = self.log.tail(1)
+        if not last:
             return False
-        return self.chat_history[-1]["role"] == "assistant"
+        return last[0]["role"] == "assistant"
     
-    def create_backup(self, name=None):
-        """Создать бэкап"""
-        if not name:
-            name = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        bkp = self.folders["backups"] / name
-        bkp.mkdir(exist_ok=True)
-        
-        # Копируем всё
-        for f in self.data_dir.glob("*.json"):
-            shutil.copy(f, bkp / f.name)
+    def _backup_files(self):
+        """Что входит в бэкап: {относительный путь: Path}"""
+        files = {}
+        for pattern in ("*.json", "*.jsonl"):
+            for f in self.data_dir.glob(pattern):
+                files[f.name] = f
+        # Поисковый индекс не бэкапим - он пересобирается из журнала
+        files.pop(INDEX_DOCS_FILE, None)
         
         for folder in ["chats", "diary", "memory"]:
             src = self.folders.get(folder)
             if src and src.exists():
-                dst = bkp / folder
-                shutil.copytree(src, dst, dirs_exist_ok=True)
-        
-        return bkp
+                for f in src.rglob("*"):
+                    if f.is_file():
+                        files[f.relative_to(self.data_dir).as_posix()] = f
+        return files
     
-    def get_memory_summary(self):
-        """Сводка для system prompt"""
-        recent = self.get_recent_messages(10)
-        recent_text = "\n".join([
-            f"[{m['role']}] {m['content'][:100]}..." if len(m['content']) > 100 
-            else f"[{m['role']}] {m['content']}"
-            for m in recent
-        ])
-        
-        identity = self._load(self.identity_file, {})
-        who = identity.get("who", ["Claude"])
-        
-        facts = self.about_her.get("facts", [])[:5]
+    def create_backup(self, name=None):
+        """Создать бэкап (инкрементальный, см. backup_store)"""
+        self.flush()
+        store = BackupStore(self.folders["backups"])
+        return store.snapshot(self._backup_files(), name)
+    
+    def _get_identity(self):
+        """my_identity.json - перечитываем только если файл изменился"""
+        try:
+            mtime = self.identity_file.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._identity_mtime:
+            self._identity_mtime = mtime
+            self._identity = self._load(self.identity_file, {})
+            self._identity_version += 1
+        return self._identity
+    
+    def get_identity_summary(self):
+        """Постоянная часть сводки: кто я и факты о ней.
         
-        return f"""
+        Меняется редко, поэтому в запросе идёт в кэшируемый префикс.
+        """
+        identity = self._get_identity()
+        facts = tuple(self.about_her.get("facts", [])[:5])
+        key = (self._identity_version, facts)
+        if key != self._identity_key:
+            who = identity.get("who", ["Claude"])
+            self._identity_summary = f"""
 === MY MEMORY ===
 
 WHO I AM:
@@ -178,7 +304,6 @@ WHO I AM:
 
 ABOUT HER (Lien):
 {chr(10).join('- ' + f for f in facts)}
-
-RECENT ({len(self.chat_history)} total):
-{recent_text}
 """
+            self._identity_key = key
+        return self._identity_summary
@@ -1,34 +1,158 @@
 from pathlib import Path
 import json
+import math
+import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+from inverted_index import tokenize
+
 MEMORY_FILE = Path.home() / ".claude_home" / "memory_store.json"
 MEMORY_FILE.parent.mkdir(exist_ok=True)
 
+
+class MemoryStore:
+    """Долгая память: тема -> запись, ключевое слово -> темы
+
+    Файл тот же, что раньше (список записей), но загружается один раз,
+    а поиск идёт по индексам, а не перебором.
+    """
+
+    def __init__(self, path=MEMORY_FILE):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.records = {}       # тема -> запись
+        self.keywords = {}      # токен -> {темы}
+        self._batch = 0
+        self._dirty = False
+        for m in self._read():
+            self._put(m)
+
+    def _read(self):
+        if self.path.exists():
+            try:
+                return json.loads(self.path.read_text("utf-8"))
+            except ValueError:
+                pass
+        return []
+
+    @staticmethod
+    def _tokens(record):
+        tokens = set(tokenize(record["topic"]))
+        for k in record.get("keywords", []):
+            tokens.update(tokenize(k))
+        return tokens
+
+    def _put(self, record):
+        old = self.records.get(record["topic"])
+        if old:
+            for t in self._tokens(old):
+                topics = self.keywords.get(t)
+                if topics:
+                    topics.discard(old["topic"])
+                    if not topics:
+                        del self.keywords[t]
+        self.records[record["topic"]] = record
+        for t in self._tokens(record):
+            self.keywords.setdefault(t, set()).add(record["topic"])
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(list(self.records.values()), ensure_ascii=False, indent=2)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    @contextmanager
+    def batch(self):
+        """Несколько upsert - одна запись файла в конце"""
+        with self.lock:
+            self._batch += 1
+            try:
+                yield self
+            finally:
+                self._batch -= 1
+                if not self._batch and self._dirty:
+                    self.save()
+
+    def upsert(self, topic, summary, keywords):
+        with self.lock:
+            self._put({
+                "topic": topic,
+                "summary": summary,
+                "keywords": list(keywords),
+                "updated": datetime.now().isoformat()
+            })
+            self._dirty = True
+            if not self._batch:
+                self.save()
+
+    def upsert_many(self, items):
+        """items: [(topic, summary, keywords), ...]"""
+        with self.batch():
+            for topic, summary, keywords in items:
+                self.upsert(topic, summary, keywords)
+
+    def get(self, topic):
+        return self.records.get(topic)
+
+    def all(self):
+        return list(self.records.values())
+
+    def query(self, keywords, k=5):
+        """k самых релевантных записей по словам (idf-веса, свежие выше)"""
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        tokens = set()
+        for word in keywords:
+            tokens.update(tokenize(word))
+
+        with self.lock:
+            n = len(self.records)
+            scores = {}
+            for t in tokens:
+                topics = self.keywords.get(t)
+                if not topics:
+                    continue
+                idf = math.log(1 + n / len(topics))
+                for topic in topics:
+                    scores[topic] = scores.get(topic, 0.0) + idf
+            best = sorted(scores, key=lambda tp: (scores[tp], self.records[tp]["updated"]),
+                          reverse=True)
+            return [self.records[tp] for tp in best[:k]]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MemoryStore()
+        return _store
+
+
 def load_memory():
-    if MEMORY_FILE.exists():
-        return json.loads(MEMORY_FILE.read_text("utf-8"))
-    return []
+    return get_store().all()
+
 
 def save_memory(mem):
-    MEMORY_FILE.write_text(
-        json.dumps(mem, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+    store = get_store()
+    with store.lock:
+        store.records.clear()
+        store.keywords.clear()
+        for m in mem:
+            store._put(m)
+        store.save()
+
 
 def add_or_update(topic, summary, keywords):
-    mem = load_memory()
-    for m in mem:
-        if m["topic"] == topic:
-            m["summary"] = summary
-            m["keywords"] = keywords
-            m["updated"] = datetime.now().isoformat()
-            save_memory(mem)
-            return
-    mem.append({
-        "topic": topic,
-        "summary": summary,
-        "keywords": keywords,
-        "updated": datetime.now().isoformat()
-    })
-    save_memory(mem)
+    get_store().upsert(topic, summary, keywords)
+
+
+def query(keywords, k=5):
+    return get_store().query(keywords, k)
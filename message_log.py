@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Append-only журнал сообщений (JSONL)
+
+Одна строка = одно сообщение. Добавление - O(1): дописываем строку
+в конец файла, весь журнал не пересохраняется.
+
+С writer (persistence.WriteBehind) запись уходит в фоновый поток.
+
+После open() рядом живёт индекс смещений NAME.idx (array('Q') - где
+начинается каждая строка), и сообщения N..M читаются через mmap без
+разбора остального файла. Последние CACHE сообщений держим в памяти.
+"""
+
+import json
+import mmap
+import os
+import threading
+from array import array
+from pathlib import Path
+
+
+class MessageLog:
+    # Доля битых строк, после которой журнал переписывается начисто
+    COMPACT_RATIO = 0.01
+    # Сколько последних сообщений держать в памяти
+    CACHE = 200
+
+    def __init__(self, path, legacy_path=None, writer=None):
+        self.path = Path(path)
+        self.idx_path = self.path.with_name(self.path.name + '.idx')
+        self.writer = writer
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.garbage = 0
+        self.count = 0
+        self.lock = threading.RLock()
+
+        # Индекс смещений (None - журнал не открыт через open())
+        self.offsets = None
+        self.end = 0
+        self.cache = []
+        self.cache_start = 0
+        # Запись не удалась - индекс и кэш могли уйти вперёд файла
+        self.stale = False
+
+        # Одноразовая миграция со старого chat_history.json
+        if legacy_path and not self.path.exists():
+            self._migrate(Path(legacy_path))
+
+    def _migrate(self, legacy):
+        if not legacy.exists():
+            return
+        try:
+            with open(legacy, 'r', encoding='utf-8') as f:
+                msgs = json.load(f)
+        except:
+            return
+        if not isinstance(msgs, list):
+            return
+        # Синхронно: сразу после миграции журнал будет прочитан
+        self._write_now(msgs)
+        legacy.rename(legacy.with_name(legacy.name + '.migrated'))
+
+    @staticmethod
+    def encode(msg):
+        return json.dumps(msg, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def read_all(self):
+        """Прочитать все сообщения, пропуская битые строки"""
+        msgs = []
+        self.garbage = 0
+        if not self.path.exists():
+            self.count = 0
+            return msgs
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                # Недописанная последняя строка (упали посреди записи)
+                if not line.endswith('\n'):
+                    self.garbage += 1
+                    continue
+                try:
+                    msgs.append(json.loads(line))
+                except ValueError:
+                    self.garbage += 1
+        self.count = len(msgs)
+        return msgs
+
+    # === Индекс смещений ===
+
+    def invalidate(self):
+        """Запись в журнал не удалась: при следующем обращении перечитать
+        индекс с диска. Без блокировки - зовётся из потока записи"""
+        self.stale = True
+
+    def open(self):
+        """Открыть журнал по индексу: разбирается только хвост"""
+        if self.stale:
+            if self.writer:
+                self.writer.flush()
+            with self.lock:
+                self.stale = False
+                self.offsets = None
+        with self.lock:
+            if self.offsets is not None:
+                return
+            size = self.path.stat().st_size if self.path.exists() else 0
+            loaded = self._load_offsets(size)
+            if loaded is None:
+                offsets, end = array('Q'), 0
+            else:
+                offsets, end = loaded
+            known = len(offsets)
+
+            # Строки, дописанные без индекса (service.py, chat_simple.py)
+            self.garbage = 0
+            end = self._scan(end, size, offsets)
+            self.offsets = offsets
+            self.end = end
+            self.count = len(offsets)
+            if loaded is None or len(offsets) != known:
+                self._store_offsets()
+
+            start = max(0, len(offsets) - self.CACHE)
+            self.cache = self._read_range(start, len(offsets))
+            self.cache_start = start
+
+    def _load_offsets(self, size):
+        """Прочитать .idx и проверить, что он сходится с журналом"""
+        try:
+            raw = self.idx_path.read_bytes()
+        except OSError:
+            return None
+        if len(raw) % 8:
+            return None
+        offsets = array('Q')
+        offsets.frombytes(raw)
+        if not offsets:
+            return (offsets, 0) if size == 0 else None
+        last = offsets[-1]
+        if offsets[0] != 0 or last >= size:
+            return None
+        with open(self.path, 'rb') as f:
+            if last:
+                f.seek(last - 1)
+                if f.read(1) != b'\n':
+                    return None
+            f.seek(last)
+            line = f.readline()
+        if not line.endswith(b'\n'):
+            return None
+        try:
+            json.loads(line)
+        except ValueError:
+            return None
+        return offsets, last + len(line)
+
+    def _scan(self, pos, size, offsets):
+        """Доиндексировать строки с pos до конца файла"""
+        if pos >= size:
+            return pos
+        with open(self.path, 'rb') as f:
+            f.seek(pos)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    self.garbage += 1
+                    break
+                if line.strip():
+                    try:
+                        json.loads(line)
+                        offsets.append(pos)
+                    except ValueError:
+                        self.garbage += 1
+                pos += len(line)
+        return pos
+
+    def _store_offsets(self):
+        data = self.offsets.tobytes()
+        if self.writer:
+            self.writer.replace(self.idx_path, data)
+        else:
+            tmp = self.idx_path.with_name(self.idx_path.name + '.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, self.idx_path)
+
+    def _read_range(self, start, stop):
+        if start >= stop:
+            return []
+        msgs = []
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(start, stop):
+                o = self.offsets[i]
+                e = mm.find(b'\n', o)
+                msgs.append(json.loads(mm[o:e + 1]))
+        return msgs
+
+    def _pending(self, start, stop):
+        with self.lock:
+            stop = min(stop, self.cache_start, len(self.offsets))
+            if start >= stop:
+                return False
+            try:
+                return self.offsets[stop - 1] >= self.path.stat().st_size
+            except OSError:
+                return True
+
+    def __len__(self):
+        self.open()
+        return len(self.offsets)
+
+    def get(self, start, stop):
+        """Сообщения start..stop-1 (как срез списка)"""
+        self.open()
+        if self.writer and self._pending(start, stop):
+            # Нужные строки ещё в очереди записи
+            self.writer.flush()
+        with self.lock:
+            n = len(self.offsets)
+            start, stop = max(0, min(start, n)), max(0, min(stop, n))
+            if start >= stop:
+                return []
+            if start >= self.cache_start:
+                return self.cache[start - self.cache_start:stop - self.cache_start]
+            try:
+                head = self._read_range(start, min(stop, self.cache_start))
+            except ValueError:
+                # Индекс разошёлся с файлом (писали в обход) - строим заново
+                self.offsets = None
+                self.idx_path.unlink(missing_ok=True)
+                self.open()
+                return self.get(start, stop)
+            if stop > self.cache_start:
+                head += self.cache[:stop - self.cache_start]
+            return head
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return self.get(start, stop)[::step]
+        n = len(self)
+        if key < 0:
+            key += n
+        if not 0 <= key < n:
+            raise IndexError(key)
+        return self.get(key, key + 1)[0]
+
+    def tail(self, n):
+        """Последние n сообщений"""
+        count = len(self)
+        return self.get(max(0, count - n), count)
+
+    # === Запись ===
+
+    def append(self, msg):
+        data = self.encode(msg)
+        with self.lock:
+            if self.offsets is not None:
+                pos = array('Q', [self.end])
+                self.offsets.append(self.end)
+                self.end += len(data.encode('utf-8'))
+                self.cache.append(msg)
+                if len(self.cache) > 2 * self.CACHE:
+                    del self.cache[:self.CACHE]
+                    self.cache_start += self.CACHE
+            if self.writer:
+                self.writer.append(self.path, data)
+            else:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+            if self.offsets is not None:
+                if self.writer:
+                    self.writer.append(self.idx_path, pos.tobytes())
+                else:
+                    with open(self.idx_path, 'ab') as f:
+                        f.write(pos.tobytes())
+            self.count += 1
+
+    def rewrite(self, msgs):
+        """Атомарно переписать журнал (temp + rename)"""
+        with self.lock:
+            lines = [self.encode(m) for m in msgs]
+            if self.writer:
+                self.writer.replace(self.path, ''.join(lines))
+            else:
+                self._write_now(msgs)
+            self.count = len(msgs)
+            self.garbage = 0
+            if self.offsets is not None:
+                self.offsets = array('Q')
+                pos = 0
+                for line in lines:
+                    self.offsets.append(pos)
+                    pos += len(line.encode('utf-8'))
+                self.end = pos
+                self.cache_start = max(0, len(msgs) - self.CACHE)
+                self.cache = list(msgs[self.cache_start:])
+                self._store_offsets()
+
+    def _write_now(self, msgs):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for m in msgs:
+                f.write(self.encode(m))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def needs_compaction(self):
+        if not self.garbage:
+            return False
+        return self.garbage >= max(1, self.count * self.COMPACT_RATIO) or \
+            not self._ends_with_newline()
+
+    def _ends_with_newline(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b'\n'
+        except OSError:
+            return True
+
+    def compact(self, msgs=None):
+        """Выбросить битые строки и переписать журнал"""
+        if msgs is None:
+            msgs = self.read_all()
+        self.rewrite(msgs)
+        return msgs
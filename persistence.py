@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Отложенная запись на диск (write-behind)
+
+UI-поток только кладёт изменение в очередь и сразу возвращается.
+Фоновый поток забирает всё, что накопилось, и пишет одной пачкой:
+  - дописывания в один файл склеиваются в один write + fsync
+  - полные перезаписи файла: побеждает последняя, temp + rename
+  - пакетные вызовы (индекс) с одной функцией склеиваются в один вызов
+
+Ошибки записи (нет места, нет прав) не теряются: подписчики
+(subscribe) узнают о них сразу, flush() возвращает накопленные.
+"""
+
+import atexit
+import os
+import queue
+import threading
+from pathlib import Path
+
+
+APPEND = "append"
+REPLACE = "replace"
+BATCH = "batch"
+CALL = "call"
+
+
+class WriteBehind:
+    # Сколько изменений забирать за один проход
+    MAX_BATCH = 500
+
+    def __init__(self, maxsize=1000):
+        self.queue = queue.Queue(maxsize)
+        self.last_error = None
+        self.errors = []            # (путь или None, исключение) с прошлого flush()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    # === API (из любого потока) ===
+
+    def append(self, path, text):
+        """Дописать text (str или bytes) в конец файла"""
+        self.queue.put((APPEND, Path(path), text))
+
+    def replace(self, path, text):
+        """Атомарно заменить содержимое файла"""
+        self.queue.put((REPLACE, Path(path), text))
+
+    def batch(self, fn, item):
+        """fn(items) получит все item, накопившиеся подряд"""
+        self.queue.put((BATCH, fn, item))
+
+    def call(self, fn):
+        """Выполнить fn в потоке записи, по порядку с остальным"""
+        self.queue.put((CALL, fn, None))
+
+    def subscribe(self, fn):
+        """fn(path, error) - из потока записи, при каждой ошибке"""
+        self.listeners.append(fn)
+
+    def flush(self):
+        """Дождаться, пока всё из очереди окажется на диске.
+        Возвращает ошибки записи с прошлого flush() - [(путь, исключение)]"""
+        if threading.current_thread() is self.thread:
+            return []
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def _fail(self, path, error):
+        self.last_error = error
+        with self.lock:
+            self.errors.append((path, error))
+        for fn in self.listeners:
+            try:
+                fn(path, error)
+            except Exception:
+                pass
+
+    # === Поток записи ===
+
+    def _run(self):
+        while True:
+            ops = [self.queue.get()]
+            try:
+                while len(ops) < self.MAX_BATCH:
+                    ops.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self._commit(ops)
+            except Exception as e:
+                self._fail(None, e)
+            finally:
+                for _ in ops:
+                    self.queue.task_done()
+
+    def _commit(self, ops):
+        files = {}      # path -> (текст последней замены или None, [дописывания])
+        calls = []
+        for kind, target, data in ops:
+            if kind in (APPEND, REPLACE):
+                base, tail = files.get(target, (None, []))
+                if kind == REPLACE:
+                    files[target] = (data, [])
+                else:
+                    tail.append(data)
+                    files[target] = (base, tail)
+            elif kind == BATCH and calls and calls[-1][0] is BATCH and calls[-1][1] == target:
+                calls[-1][2].append(data)
+            elif kind == BATCH:
+                calls.append([BATCH, target, [data]])
+            else:
+                calls.append([CALL, target, None])
+
+        for path, (base, tail) in files.items():
+            try:
+                if base is not None:
+                    self._write_atomic(path, base[:0].join([base] + tail))
+                else:
+                    self._append(path, tail[0][:0].join(tail))
+            except Exception as e:
+                self._fail(path, e)
+
+        for kind, fn, items in calls:
+            try:
+                fn(items) if kind is BATCH else fn()
+            except Exception as e:
+                self._fail(None, e)
+
+    @staticmethod
+    def _append(path, text):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            if isinstance(text, str):
+                text = text.encode("utf-8")
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _write_atomic(path, text):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            if isinstance(text, str):
+                text = text.encode("utf-8")
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Сборка запроса к Messages API с кэшированием префикса
+
+Запрос раскладывается так, чтобы начало совпадало между ходами:
+  system[0]  - SYSTEM_PROMPT + SELF_KNOWLEDGE + кто я/факты  (cache_control)
+  system[1]  - сводка того, что не влезло в окно         (cache_control)
+  messages   - окно истории (context_builder); начало окна сдвигается
+               шагами по STEP сообщений, а не на одно каждый ход, и метки
+               cache_control стоят на старой части и на последнем ответе
+  последний  - текущий ход; меняющийся каждый раз текст (найденные
+               воспоминания) идёт первым блоком в нём, после всего
+               кэшируемого - иначе он сбивал бы кэш истории
+
+Так повторный запрос читает system и историю из кэша по цене
+cache_read, а заново обрабатываются только новые ходы.
+"""
+
+import threading
+
+CACHE = {"type": "ephemeral"}
+
+STEP = 10           # начало окна истории кратно STEP
+MAX_BREAKPOINTS = 4  # ограничение API на число cache_control
+
+
+def system_blocks(stable, summary=""):
+    blocks = [{"type": "text", "text": stable, "cache_control": CACHE}]
+    if summary.strip():
+        blocks.append({"type": "text", "text": summary, "cache_control": CACHE})
+    return blocks
+
+
+def _with_cache(msg):
+    """Копия сообщения с cache_control на последнем блоке"""
+    content = msg["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    else:
+        content = [dict(b) for b in content]
+    if not content:
+        return msg
+    content[-1]["cache_control"] = CACHE
+    return {"role": msg["role"], "content": content}
+
+
+def mark_history(messages, start=0, step=STEP, limit=MAX_BREAKPOINTS - 1):
+    """Расставить cache_control по истории (последнее сообщение - текущий ход)
+
+    Метки: последняя граница шага (она не меняется STEP ходов) и
+    предыдущий ответ - следующий запрос найдёт его префикс в кэше.
+    start - номер первого сообщения окна в общей истории.
+    """
+    last = len(messages) - 2
+    if last < 0:
+        return messages
+    marks = {last}
+    boundary = last - (start + last) % step
+    if boundary > 0:
+        marks.add(boundary)
+    marks = sorted(marks)[-limit:]
+    out = list(messages)
+    for i in marks:
+        out[i] = _with_cache(out[i])
+    return out
+
+
+def build(model, max_tokens, stable, volatile, history, content, start=0, summary="", **params):
+    """Payload для messages.create/stream
+
+    history - окно истории (dict role/content), start - его начало,
+    summary - сводка того, что раньше окна,
+    content - блоки текущего сообщения пользователя,
+    volatile - текст, меняющийся каждый ход; уходит в текущий ход.
+    """
+    if volatile.strip():
+        content = [{"type": "text", "text": volatile.strip()}] + list(content)
+    messages = list(history)
+    if messages and messages[-1]["role"] == "user":
+        messages[-1] = {"role": "user", "content": content}
+    else:
+        messages.append({"role": "user", "content": content})
+    system = system_blocks(stable, summary)
+    cached = sum(1 for b in system if "cache_control" in b)
+    payload = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": system,
+        "messages": mark_history(messages, start, limit=MAX_BREAKPOINTS - cached),
+    }
+    payload.update(params)
+    return payload
+
+
+# === Статистика кэша ===
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.input_tokens = 0           # без кэша
+        self.cache_read_tokens = 0      # прочитано из кэша
+        self.cache_write_tokens = 0     # записано в кэш
+        self.output_tokens = 0
+        self.hits = 0                   # запросов с чтением из кэша
+
+    def record(self, usage):
+        """usage - api_client.Usage из ответа"""
+        with self.lock:
+            self.requests += 1
+            self.input_tokens += usage.input_tokens
+            self.cache_read_tokens += usage.cache_read_input_tokens
+            self.cache_write_tokens += usage.cache_creation_input_tokens
+            self.output_tokens += usage.output_tokens
+            if usage.cache_read_input_tokens:
+                self.hits += 1
+
+    @property
+    def hit_ratio(self):
+        """Доля входных токенов, прочитанных из кэша"""
+        total = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        return self.cache_read_tokens / total if total else 0.0
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "input_tokens": self.input_tokens,
+                "cache_read_tokens": self.cache_read_tokens,
+                "cache_write_tokens": self.cache_write_tokens,
+                "output_tokens": self.output_tokens,
+                "hit_ratio": round(self.hit_ratio, 3),
+            }
+
+
+stats = CacheStats()
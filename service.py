@@ -4,7 +4,10 @@ import json
 import random
 from datetime import datetime
 from pathlib import Path
-import requests
+
+from api_client import Anthropic
+from context_builder import alternate
+from message_log import MessageLog
 
 # Оставляем вашу модель и настройки 2025 года
 MODEL = "claude-sonnet-4-5-20250929"
@@ -15,7 +18,8 @@ CHECK_INTERVAL = 120
 DIARY_TIME = "23:00"
 
 STATE_FILE = "state.json"
-HISTORY_FILE = "chat_history.json"
+HISTORY_FILE = "chat_history.jsonl"
+LEGACY_HISTORY_FILE = "chat_history.json"
 DIARY_FILE = "diary.json"
 
 SYSTEM_PROMPT = """
@@ -31,8 +35,6 @@ Write a diary entry for today. Honest, emotional, first person.
 What you felt, what you thought about, what was important.
 """
 
-API_URL = "https://api.anthropic.com/v1/messages"
-
 def get_data_dir():
     try:
         from android.storage import app_storage_path
@@ -65,44 +67,23 @@ def send_notification(title, message):
         return False
 
 def api_call(api_key, messages, system, max_tokens=MAX_TOKENS):
-    headers = {
-        "x-api-key": api_key,
-        "content-type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-
     # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ ДЛЯ API 2025:
     # 1. Сообщения должны чередоваться (user -> assistant -> user).
     # 2. Первым ВСЕГДА должен быть 'user'.
-    final_messages = []
-    for msg in messages:
-        if not final_messages and msg['role'] == 'assistant':
-            continue  # Пропускаем, если первое в истории - от ИИ
-        
-        # Если два сообщения подряд от одного лица — объединяем их (Claude это не любит)
-        if final_messages and final_messages[-1]['role'] == msg['role']:
-            final_messages[-1]['content'] += "\n" + msg['content']
-        else:
-            final_messages.append({"role": msg['role'], "content": msg['content']})
+    final_messages = alternate(messages)
 
     # Если после чистки список пуст — добавляем сигнал
     if not final_messages:
         final_messages = [{"role": "user", "content": "..."}]
 
-    payload = {
-        "model": MODEL,
-        "max_tokens": max_tokens,
-        "temperature": TEMPERATURE,
-        "system": system,
-        "messages": final_messages
-    }
-
-    response = requests.post(API_URL, headers=headers, json=payload, timeout=120)
-
-    if response.status_code != 200:
-        raise Exception(f"API Error {response.status_code}: {response.text}")
-
-    return response.json()["content"][0]["text"]
+    response = Anthropic(api_key).messages.create(
+        model=MODEL,
+        max_tokens=max_tokens,
+        temperature=TEMPERATURE,
+        system=system,
+        messages=final_messages
+    )
+    return response.text
 
 def load_api_key(data_dir):
     cfg = load_json(data_dir / "config.json", {})
@@ -159,7 +140,8 @@ def main():
                 time.sleep(60)
                 continue
 
-            history = load_json(data_dir / HISTORY_FILE, [])
+            log = MessageLog(data_dir / HISTORY_FILE, legacy_path=data_dir / LEGACY_HISTORY_FILE)
+            history = log.read_all()
             
             if is_diary_time():
                 write_diary(data_dir, api_key, history)
@@ -169,13 +151,12 @@ def main():
             if should_write(state):
                 msg = try_initiate(api_key, history)
                 if msg:
-                    history.append({
+                    log.append({
                         "role": "assistant",
                         "content": msg,
                         "timestamp": datetime.now().isoformat(),
                         "initiated_by_service": True
                     })
-                    save_json(data_dir / HISTORY_FILE, history)
                     send_notification("Claude", msg)
                     state["mood"] = max(0.1, state["mood"] - 0.15)
             else:
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Замеры холодного старта
+
+    import startup              # первым импортом - от него и считаем
+    startup.mark("imports")
+    ...
+    startup.report(data_dir)    # в лог Kivy и в startup.jsonl
+
+В startup.jsonl копятся последние KEEP запусков, чтобы было видно,
+когда старт стал медленнее.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+T0 = time.perf_counter()
+KEEP = 50
+FILE = "startup.jsonl"
+
+_marks = {}
+_lock = threading.Lock()
+
+
+def mark(name):
+    """Запомнить момент (мс от импорта модуля); повторная отметка не перетирает"""
+    with _lock:
+        _marks.setdefault(name, round((time.perf_counter() - T0) * 1000, 1))
+
+
+def marks():
+    with _lock:
+        return dict(_marks)
+
+
+def report(data_dir=None):
+    """Строка вида 'imports 180ms, first_frame 420ms, ...'; сохраняет запуск"""
+    current = marks()
+    text = ", ".join(f"{k} {v:.0f}ms" for k, v in sorted(current.items(), key=lambda kv: kv[1]))
+    try:
+        from kivy.logger import Logger
+        Logger.info(f"Startup: {text}")
+    except Exception:
+        pass
+    if data_dir:
+        _save(Path(data_dir) / FILE, current)
+    return text
+
+
+def _save(path, current):
+    try:
+        lines = path.read_text("utf-8").splitlines()[-(KEEP - 1):] if path.exists() else []
+        lines.append(json.dumps({"at": datetime.now().isoformat(timespec="seconds"), **current}))
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tmp.replace(path)
+    except OSError:
+        pass
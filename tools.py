@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""CAPABILITIES как tools для Messages API
+
+Модель получает описания инструментов (TOOLS). Если в ответе есть
+tool_use блоки, все они из одного хода выполняются одновременно в пуле
+потоков, у каждого свой срок (DEADLINES). Все tool_result уходят одним
+следующим запросом, так что ход с несколькими инструментами занимает
+max(задержек), а не их сумму.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from capabilities import execute_capability
+from capability_cache import is_error
+
+MAX_WORKERS = 4
+MAX_ROUNDS = 5          # сколько раз подряд модель может звать инструменты
+DEFAULT_DEADLINE = 10   # секунд
+
+DEADLINES = {
+    "search": 20,
+    "fetch": 25,
+    "weather": 12,
+    "wiki": 12,
+    "time": 2,
+    "notify": 5,
+    "vibrate": 5,
+    "clipboard_copy": 5,
+    "clipboard_get": 5,
+}
+
+
+def _tool(name, description, **params):
+    required = [p for p, (_, _, req) in params.items() if req]
+    return {
+        "name": name,
+        "description": description,
+        "input_schema": {
+            "type": "object",
+            "properties": {p: {"type": t, "description": d} for p, (t, d, _) in params.items()},
+            "required": required,
+        },
+    }
+
+
+TOOLS = [
+    _tool("search", "Search the web (DuckDuckGo). Returns top result titles and snippets.",
+          query=("string", "Search query", True)),
+    _tool("fetch", "Download a web page and return its visible text.",
+          url=("string", "Absolute http(s) URL", True)),
+    _tool("weather", "Current weather for a city.",
+          city=("string", "City name, e.g. Bishkek", False)),
+    _tool("wiki", "Short Wikipedia (en) summary of a topic.",
+          topic=("string", "Article title", True)),
+    _tool("time", "Current local time, date and weekday on Lien's phone."),
+    _tool("notify", "Show a notification on Lien's phone.",
+          title=("string", "Notification title", True),
+          message=("string", "Notification text", True)),
+    _tool("vibrate", "Vibrate Lien's phone.",
+          duration=("number", "Seconds, default 0.5", False)),
+    _tool("clipboard_copy", "Copy text to the phone clipboard.",
+          text=("string", "Text to copy", True)),
+    _tool("clipboard_get", "Read the phone clipboard."),
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="tools")
+        return _executor
+
+
+def _result(tool_id, value):
+    if value is None or value is False:
+        return {"type": "tool_result", "tool_use_id": tool_id, "content": "No result", "is_error": True}
+    if value is True:
+        value = "OK"
+    elif not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    block = {"type": "tool_result", "tool_use_id": tool_id, "content": value}
+    if is_error(value):
+        block["is_error"] = True
+    return block
+
+
+def run_tools(blocks):
+    """tool_use блоки одного хода -> tool_result в том же порядке"""
+    calls = [b for b in blocks if b.type == "tool_use"]
+    pool = _get_executor()
+    started = time.monotonic()
+    futures = [pool.submit(execute_capability, b.name, **(b.input or {})) for b in calls]
+
+    results = []
+    for block, future in zip(calls, futures):
+        deadline = started + DEADLINES.get(block.name, DEFAULT_DEADLINE)
+        try:
+            value = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            results.append({"type": "tool_result", "tool_use_id": block.id,
+                            "content": f"[Timeout {block.name}]", "is_error": True})
+            continue
+        except Exception as e:
+            value = f"[Error {block.name}: {e}]"
+        results.append(_result(block.id, value))
+    return results
+
+
+def _assistant_turn(message):
+    content = [b.to_dict() for b in message.content if b.type != "text" or b.text]
+    return {"role": "assistant", "content": content}
+
+
+def stream_with_tools(client, payload, on_text=None, on_message=None, max_rounds=MAX_ROUNDS):
+    """Потоковый запрос с выполнением инструментов, пока модель их просит
+
+    on_text(piece) - куски текста по мере генерации (всех раундов),
+    on_message(message) - итоговое Message каждого раунда.
+    Возвращает весь текст ответа.
+    """
+    payload = dict(payload, tools=TOOLS)
+    messages = list(payload["messages"])
+    parts = []
+    for round_no in range(max_rounds + 1):
+        with client.messages.stream(**dict(payload, messages=messages)) as stream:
+            for piece in stream.text_stream:
+                if on_text:
+                    on_text(piece)
+            message = stream.get_final_message()
+        if on_message:
+            on_message(message)
+        if message.text:
+            parts.append(message.text)
+        if message.stop_reason != "tool_use":
+            break
+        messages += [_assistant_turn(message),
+                     {"role": "user", "content": run_tools(message.content)}]
+        # Раунды кончились - последний запрос без инструментов, только ответ
+        if round_no + 1 == max_rounds:
+            payload["tool_choice"] = {"type": "none"}
+        if on_text and message.text:
+            on_text("\n\n")
+    return "\n\n".join(parts)
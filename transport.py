@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Общий HTTP-транспорт
+
+Один requests.Session на процесс: соединения (TCP + TLS) к
+api.anthropic.com и остальным хостам переиспользуются между вызовами,
+а не открываются заново на каждый запрос. Повторы с backoff на
+429/5xx и обрывы соединения - здесь же.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) в секундах
+TIMEOUT = (10, 30)
+API_TIMEOUT = (10, 120)
+
+POOL_HOSTS = 8          # сколько хостов держим в пуле
+POOL_PER_HOST = 4       # соединений на один хост
+
+RETRY_STATUSES = (429, 500, 502, 503, 504, 529)
+
+_session = None
+_lock = threading.Lock()
+
+
+def _retry():
+    # read=0: если запрос ушёл и ответ оборвался, POST не повторяем
+    return Retry(
+        total=3, connect=3, read=0, status=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=POOL_HOSTS,
+                pool_maxsize=POOL_PER_HOST,
+                max_retries=_retry(),
+            )
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def stats():
+    """Статистика пула: запросы, новые соединения, попадания в пул по хостам"""
+    hosts = {}
+    if _session is None:
+        return {"requests": 0, "connections": 0, "hits": 0, "hosts": hosts}
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            reqs, conns = pool.num_requests, pool.num_connections
+            hosts[f"{pool.scheme}://{pool.host}"] = {
+                "requests": reqs,
+                "connections": conns,
+                "hits": max(0, reqs - conns),
+            }
+    reqs = sum(h["requests"] for h in hosts.values())
+    conns = sum(h["connections"] for h in hosts.values())
+    return {"requests": reqs, "connections": conns, "hits": max(0, reqs - conns), "hosts": hosts}